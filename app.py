@@ -1,3 +1,8 @@
+import asyncio
+import os
+import types
+from concurrent.futures import ThreadPoolExecutor
+
 from shiny import App, ui, render, reactive
 from shinywidgets import render_plotly, output_widget, render_widget
 from datetime import timedelta
@@ -6,17 +11,106 @@ import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
 
-# Load data
-branch_names = pd.read_csv("cplbranches/data/branch_names_crosswalk.csv")
-visits_data_all = pd.read_csv("cplbranches/data/visits_data_all.csv")
-public_calendar = pd.read_csv("cplbranches/data/public_calendar.csv")
-branch_service_census_food_data = pd.read_csv("cplbranches/data/branch_service_census_food_data.csv")
-comp_use = pd.read_csv("cplbranches/data/branch_computer_use.csv")
-branch_titles_filtered = pd.read_csv("cplbranches/data/branch_titles_filtered.csv")
-branch_physical_reading = pd.read_csv("cplbranches/data/branch_physical_reading_fix.csv")
+from datastore import BranchPartition, DataStore, branch_records
+from downsample import MAX_POINTS, lttb_indices
+from figure_cache import FigureCache, ViewCache
+from instrumentation import ENABLED as INSTRUMENTED, metrics, timed, timed_call, with_metrics_route
+from paging import page_summary, sort_choices, sorted_tables
+from prewarm import in_prewarm_worker, prewarm
+from static_assets import AssetManifest, with_static_assets
+from title_search import TitleIndex
+from rollups import (
+    DATE_INDEXES, attendance_for_dates, branch_metrics_for_dates, build_attendance_rollups, build_branch_metrics,
+    build_circulation_rollups, circulation_for_dates, update_circulation_rollups,
+)
+from time_index import RangeIndex
+
+# Everything the outputs read is derived from the loaded frames here, once per data version
+def build_branch_data(frames, previous=None, appended=None):
+    data = types.SimpleNamespace(**frames)
+    appended = appended or {}
+
+    # On a reload, anything built only from frames that didn't change is carried over
+    def unchanged(*names):
+        return previous is not None and all(frames[name] is getattr(previous, name) for name in names)
+
+    # Partition every branch-level frame once so outputs only touch the selected branch's rows
+    data.visits_by_branch = (
+        previous.visits_by_branch if unchanged("visits_data_all") else BranchPartition(data.visits_data_all)
+    )
+    data.physical_reading_by_branch = (
+        previous.physical_reading_by_branch if unchanged("branch_physical_reading")
+        else BranchPartition(data.branch_physical_reading)
+    )
+
+    # Census and computer-use data have one row per branch, so keep each row as a plain record
+    data.census_records = (
+        previous.census_records if unchanged("branch_service_census_food_data")
+        else branch_records(data.branch_service_census_food_data)
+    )
+    data.comp_use_records = previous.comp_use_records if unchanged("comp_use") else branch_records(data.comp_use)
+
+    # The title-level data only changes with a new data version, so the Circulation tab's
+    # top-N tables are built once here. Newly appended months are added to the running
+    # totals instead of aggregating every title row again.
+    if unchanged("branch_titles_filtered"):
+        data.circulation = previous.circulation
+    elif "branch_titles_filtered" in appended:
+        data.circulation = update_circulation_rollups(previous.circulation, appended["branch_titles_filtered"])
+    else:
+        data.circulation = build_circulation_rollups(data.branch_titles_filtered)
+    # Sorted indexes over the long tables, so they can be paged, sorted and filtered server-side
+    if previous is not None and data.circulation is previous.circulation:
+        data.paged_tables = previous.paged_tables
+        data.title_index = previous.title_index
+    elif "branch_titles_filtered" in appended:
+        # Only branches with new rows have new tables; the title index adds only new titles
+        changed = set(appended["branch_titles_filtered"]["branch_name"].dropna())
+        data.paged_tables = {
+            output_id: sorted_tables(
+                data.circulation[BRANCH_TABLES[output_id]], previous.paged_tables[output_id], changed,
+            )
+            for output_id in PAGED_TABLES
+        }
+        data.title_index = TitleIndex(data.circulation["totals"]["titles"], previous.title_index)
+    else:
+        data.paged_tables = {
+            output_id: sorted_tables(data.circulation[BRANCH_TABLES[output_id]]) for output_id in PAGED_TABLES
+        }
+        # Word index over every title's per-branch totals, for the title search
+        data.title_index = TitleIndex(data.circulation["totals"]["titles"])
+    data.attendance = (
+        previous.attendance if unchanged("public_calendar") else build_attendance_rollups(data.public_calendar)
+    )
+
+    # Rows sorted by branch and date with running totals, so the date range filter slices and
+    # sums instead of filtering and regrouping whole frames. Frames without their date column
+    # aren't indexed, and keep showing all their rows.
+    def date_index(name, frame, keys, time, values, rows):
+        if unchanged(frame):
+            return previous.date_indexes[name]
+        if frame in appended and name in previous.date_indexes:
+            # New months are merged into the index instead of indexing the whole frame again
+            return previous.date_indexes[name].append(frames[frame], appended[frame])
+        return RangeIndex(frames[frame], keys, time, values, rows)
+
+    data.date_indexes = {
+        name: date_index(name, frame, keys, time, values, rows)
+        for name, (frame, keys, time, values, rows) in DATE_INDEXES.items()
+        if time in frames[frame].columns
+    }
+    spans = [index.span for index in data.date_indexes.values() if index.span is not None]
+    data.date_span = (min(span[0] for span in spans), max(span[1] for span in spans)) if spans else None
+
+    data.branches = data.branch_names["branch_name"].dropna().unique().tolist()
+
+    # Every branch's headline metrics and percentiles, for the comparison tab
+    if unchanged("branch_names", "visits_data_all", "branch_titles_filtered", "public_calendar"):
+        data.branch_metrics = previous.branch_metrics
+    else:
+        data.branch_metrics = build_branch_metrics(data.branches, frames)
+    return data
 
-# Ensure medianincome is numeric
-branch_service_census_food_data['medianincome'] = pd.to_numeric(branch_service_census_food_data['medianincome'], errors='coerce')
 
 ICONS = {
     "income": fa.icon_svg("money-bill"),
@@ -31,16 +125,462 @@ category_map = {
     "physical_item_juvenile": "Juvenile"
 }
 
+# Single-value displays: output id -> (column, format)
+CENSUS_DISPLAYS = {
+    "median_income_display": ('medianincome', "${:,.2f}"),
+    "uninsured_display": ('uninsured', "{:,.1%}"),
+    "unemployment_display": ('unemployment', "{:,.1%}"),
+    "food_display": ('overall_food_insecurity_rate', "{:,.1%}"),
+}
+COMPUTER_USE_DISPLAYS = {
+    "stations": ('total_stations', "{:,.0f}"),
+    "sessions": ('total_sessions', "{:,.0f}"),
+    "average_session_length": ('average_session_length_min', "{:,.1f} minutes"),
+}
+
+# Table outputs: output id -> circulation rollup
+BRANCH_TABLES = {
+    "top_genres_table": "genres",
+    "top_reading_level_table": "reading_levels",
+    "top_books_table": "books",
+    "top_dvds_table": "dvds",
+}
+# Tables sent to the browser a page at a time: output id -> columns they can be sorted by
+PAGED_TABLES = {
+    "top_genres_table": ['Genre', 'Checkouts'],
+    "top_books_table": ['Title', 'Category', 'Checkouts'],
+    "top_dvds_table": ['Title', 'Category', 'Checkouts'],
+}
+
+# Load data (from the columnar cache when it's current, otherwise from the CSVs). A
+# background thread checks the data directory every CPL_WATCH_DATA seconds (0 turns it
+# off) and swaps in new versions without restarting the worker.
+store = DataStore(build_branch_data)
+DATA_WATCH_SECS = float(os.environ.get("CPL_WATCH_DATA", "60"))
+
+# How often each session checks whether the store has swapped in a new version
+DATA_POLL_SECS = 5
+
+
+def paged_table_ui(output_id, placeholder):
+    # Filter and sort controls above the table, page number and row count below it
+    return ui.TagList(
+        ui.layout_columns(
+            ui.input_text(f"{output_id}_filter", None, placeholder=placeholder),
+            ui.input_select(f"{output_id}_sort", None, choices=sort_choices(PAGED_TABLES[output_id])),
+            col_widths=[6,6]
+        ),
+        ui.output_data_frame(output_id),
+        ui.layout_columns(
+            ui.input_numeric(f"{output_id}_page", None, value=1, min=1),
+            ui.output_text(f"{output_id}_rows"),
+            col_widths=[4,8]
+        ),
+    )
+
+
+def format_value(record, column, fmt):
+    # Shared missing-data handling for the single-value displays
+    if record is None:
+        return "No data found"
+    value = record.get(column)
+    if pd.isna(value):
+        return "Data not available"
+    return fmt.format(float(value))
+
+
+def months_in(data, dates):
+    # First and last day of the months picked in the date range input, or None when they
+    # cover all the data and the precomputed all-time tables and figures apply
+    if not dates or None in dates or data.date_span is None:
+        return None
+    start, end = sorted(pd.Timestamp(day) for day in dates)
+    start = start.to_period("M").start_time
+    end = end.to_period("M").end_time.normalize()
+    if start <= data.date_span[0] and end >= data.date_span[1]:
+        return None
+    return start, end
+
+
+def circulation_period(data, dates):
+    # How the Circulation tab's headings describe the months their tables cover
+    index = data.date_indexes.get("branch_titles_filtered")
+    if index is None or index.span is None:
+        return ""
+    if dates is None:
+        return f"since {index.span[0]:%b %Y}"
+    start, end = dates
+    if start.to_period("M") == end.to_period("M"):
+        return f"in {start:%b %Y}"
+    return f"from {start:%b %Y} to {end:%b %Y}"
+
+
+def branch_data_for_dates(data, branch, dates):
+    """What the builders and tables read for branch, limited to the months in dates.
+
+    Rows and totals come from the date indexes, so a range costs a few binary searches
+    and the branch's own rows rather than a pass over every frame.
+    """
+    start, end = dates
+    indexes = data.date_indexes
+    view = types.SimpleNamespace(
+        version=(data.version, start, end),
+        census_records=data.census_records,
+        visits_by_branch=data.visits_by_branch,
+        physical_reading_by_branch=data.physical_reading_by_branch,
+        circulation=data.circulation,
+        attendance=data.attendance,
+    )
+    if "visits_data_all" in indexes:
+        view.visits_by_branch = BranchPartition(indexes["visits_data_all"].rows(branch, start, end))
+    if "branch_physical_reading" in indexes:
+        view.physical_reading_by_branch = BranchPartition(indexes["branch_physical_reading"].rows(branch, start, end))
+    if "titles" in indexes:
+        view.circulation = circulation_for_dates(indexes, branch, start, end)
+    if "public_calendar" in indexes:
+        view.attendance = attendance_for_dates(indexes, branch, start, end)
+    view.paged_tables = {
+        output_id: sorted_tables(view.circulation[BRANCH_TABLES[output_id]]) for output_id in PAGED_TABLES
+    }
+    return view
+
+
+def no_data_figure():
+    return px.scatter(title="No data available for this branch.")
+
+
+# Physical item checkouts for a branch, in long format for the area chart
+def reading_levels_data(data, branch):
+    df = data.physical_reading_by_branch[branch]
+    
+    long_df = df.melt(
+        id_vars=["branch_name", "month"],
+        value_vars=[col for col in df.columns if col.startswith("physical_item_")],
+        var_name="category",
+        value_name="count"
+    )
+
+    # Map category codes to labels
+    long_df["category"] = long_df["category"].map(category_map)
+
+    return long_df.dropna(subset=["count"])
+
+
+# Figure builders. Each one depends only on the branch and the data version, so the
+# figures are built once per process and shared by every session through figure_cache.
+def age_bar_figure(data, branch):
+    census = data.census_records.get(branch)
+    if census is None:
+        return no_data_figure()
+    age_columns = ['under10', 'age10to20', 'age20to40', 'age40to60', 'age60plus']
+    age_labels = ['<10', '10–19', '20–39', '40–59', '60+']
+    values = [census[col] for col in age_columns]
+    
+    age_bar_chart = go.Figure(data=[
+        go.Bar(x=age_labels, y=values)
+    ])
+    age_bar_chart.update_layout(
+        # title='Age distribution',
+        template='plotly_white'
+    )
+    return age_bar_chart
+
+
+def race_bar_figure(data, branch):
+    census = data.census_records.get(branch)
+    if census is None:
+        return no_data_figure()
+    race_columns = ['black_pop', 'white_pop', 'asian_nhpi_pop', 'latino_pop']
+    race_labels = ['Black', 'White', 'Asian', 'Latino']
+    values = [census[col]*100 for col in race_columns]
+    
+    race_bar_chart = go.Figure(data=[
+        go.Bar(y=values, x=race_labels)
+    ])
+    race_bar_chart.update_layout(
+        template='plotly_white',
+        # xaxis_title='Population Proportion',
+        yaxis_title='',
+        margin=dict(l=0, r=10, t=10, b=10),
+        yaxis=dict(ticksuffix='%')
+    )
+    return race_bar_chart
+
+
+def visits_figure(data, branch):
+    df_filtered = data.visits_by_branch[branch]
+    df_filtered = df_filtered.sort_values("month_date")
+
+    # Keep the payload bounded for long series
+    if len(df_filtered) > MAX_POINTS:
+        df_filtered = df_filtered.dropna(subset=["value"])
+        months = pd.to_datetime(df_filtered["month_date"]).astype("int64")
+        df_filtered = df_filtered.iloc[lttb_indices(months, df_filtered["value"], MAX_POINTS)]
+    
+    fig = px.line(df_filtered, x="month_date", y="value", markers=True, title="layout.hovermode='x unified'")
+    fig.update_layout(
+        title_text='Monthly visits',
+        xaxis_title='',
+        yaxis_title='',
+        template='simple_white',
+        font=dict(size=12),
+        showlegend=False,
+        hovermode="x unified",
+        yaxis=dict(tickformat=','),
+        modebar=dict(remove=['zoom', 'pan', 'select'])
+    )
+    fig.update_traces(
+        mode="markers+lines",
+        hovertemplate=None,
+        line=dict(color="#2c3e50", width=1),
+        marker=dict(color="#2c3e50", size=6)
+    )
+    return fig
+
+
+def programs_figure(data, branch):
+    result = data.attendance["by_audience"][branch]
+
+    fig = px.bar(
+            result,
+            x='audiences',
+            y='avg_attendance',
+            title='Average program attendance by age group'
+        )
+    
+    fig.update_layout(
+            xaxis_tickangle=-45,
+            showlegend=False,
+            template='simple_white',
+            yaxis_title='Average attendance',
+            xaxis_title='',
+            margin=dict(t=60, b=120)
+        )
+    return fig
+
+
+def scatter_figure(data, branch):
+    # Events under 100 attendees, or their density buckets when there are too many to plot
+    points, step = data.attendance["scatter"][branch]
+
+    if step is not None:
+        # Too many events to ship one point each: plot density buckets sized by event count
+        fig = px.scatter(
+            points,
+            x="time_parsed",
+            y="actual_attendance",
+            size="events",
+            hover_data={
+            "actual_attendance": True,
+            "events": True,
+            "example": True,
+            "time_parsed": False
+        },
+            labels={"example": "Example event", "events": "Events"}
+        )
+        fig.update_traces(marker=dict(line=dict(width=0)))
+        if step > 1:
+            fig.update_layout(annotations=[dict(
+                text=f"Attendance grouped in bins of {step}",
+                xref="paper", yref="paper", x=1, y=1.05, showarrow=False, font=dict(size=10)
+            )])
+    else:
+        # Create jittered scatterplot
+        fig = px.scatter(
+            points,
+            x="time_parsed",
+            y="actual_attendance",
+            hover_data={
+            "actual_attendance": True,
+            "title": True,
+            "time_parsed": False  # hide if already shown as x-axis
+        }
+        )
+        fig.update_traces(marker=dict(size=6, line=dict(width=0)))
+
+    fig.update_layout(
+        title="Start time vs. in-person attendance",
+        xaxis_title="Start time",
+        yaxis_title="Attendance",
+        # Start times are parsed onto a fixed date; show only the time of day
+        xaxis=dict(tickformat="%-I:%M %p"),
+        template="simple_white"
+    )
+
+    return fig
+
+
+def readinglevels_figure(data, branch):
+    data = reading_levels_data(data, branch)
+    if data.empty:
+        return no_data_figure()
+
+    fig = px.area(
+        data,
+        x="month",
+        y="count",
+        color="category",
+        title="Physical item checkouts over time",
+        labels={"count": "Checkouts", "month": "Month", "category": "Category"}
+    )
+    fig.update_layout(
+        yaxis=dict(tickformat=","),
+        template='simple_white',
+        legend_title="Category"
+    )
+    return fig
+
+
+def reading_level_donut_figure(data, branch):
+    df = data.circulation["reading_levels"][branch]
+    if df.empty:
+        return px.scatter(title="No data available for selected branch.")
+    
+    fig = px.pie(
+        df,
+        names="Reading level",
+        values="Checkouts",
+        hole=0.4,
+        title=""
+    )
+    fig.update_traces(textinfo="percent+label", pull=[0.03]*len(df))
+    fig.update_layout(showlegend=True)
+
+    return fig
+
+
+# Comparison tab: the selected branches' rows of the precomputed metrics, and their visits
+def comparison_data(data, branches, dates=None):
+    if dates is None:
+        metrics = data.branch_metrics
+    else:
+        metrics = branch_metrics_for_dates(data.branches, vars(data), data.date_indexes, *dates)
+    return metrics.reindex(branches).round(1).reset_index()
+
+
+def title_search_data(data, query):
+    # Each branch's checkouts of the titles best matching query, with the number of matching titles
+    rows, matched = data.title_index.search(query)
+    table = pd.DataFrame({
+        "Title": rows["title"].astype(str),
+        "Category": rows["material_type_item_cat1"].astype(str),
+        "Branch": rows["branch_name"].astype(str),
+        "Checkouts": rows["checkouts"],
+    })
+    return table, matched
+
+
+def comparison_visits_figure(data, branches, dates=None):
+    visits = data.visits_data_all
+    if dates is not None and "visits_data_all" in data.date_indexes:
+        visits = pd.concat([visits.iloc[0:0]] + [data.date_indexes["visits_data_all"].rows(b, *dates) for b in branches])
+    df = visits[visits["branch_name"].isin(branches)].sort_values(["branch_name", "month_date"], kind="stable")
+    if df.empty:
+        return no_data_figure()
+    df = df.assign(branch_name=df["branch_name"].astype(str))
+
+    fig = px.line(df, x="month_date", y="value", color="branch_name",
+                  labels={"branch_name": "Branch", "month_date": "", "value": "Visits"})
+    fig.update_layout(
+        title_text='Monthly visits',
+        template='simple_white',
+        yaxis=dict(tickformat=','),
+        hovermode="x unified",
+    )
+    return fig
+
+
+FIGURE_BUILDERS = {
+    "age_bar_chart": age_bar_figure,
+    "race_bar_chart": race_bar_figure,
+    "visits_plot": visits_figure,
+    "programs_plot": programs_figure,
+    "scatter_plot": scatter_figure,
+    "readinglevels_plot": readinglevels_figure,
+    "reading_level_donut_chart": reading_level_donut_figure,
+}
+
+# Figures shown inside a tab, by tab title. Sidebar figures are always visible.
+FIGURE_TABS = {
+    "readinglevels_plot": "Circulation",
+    "reading_level_donut_chart": "Circulation",
+    "visits_plot": "Visits, Programs, and Computers",
+    "programs_plot": "Visits, Programs, and Computers",
+    "scatter_plot": "Visits, Programs, and Computers",
+    "comparison_visits_plot": "Compare branches",
+}
+
+# Figures drawn from dated rows, which follow the date range input
+DATED_FIGURES = {"visits_plot", "programs_plot", "scatter_plot", "readinglevels_plot", "reading_level_donut_chart"}
+
+figure_cache = FigureCache()
+
+
+def cached_figure(output_id, branch, data=None):
+    data = data or store.current
+    return figure_cache.get_or_build(
+        (output_id, branch, data.version),
+        lambda: FIGURE_BUILDERS[output_id](data, branch),
+    )
+
+
+def cached_comparison_figure(branches, dates=None, data=None):
+    # branches is a sorted tuple, so every selection order shares one cached figure
+    data = data or store.current
+    version = data.version if dates is None else (data.version, *dates)
+    return figure_cache.get_or_build(
+        ("comparison_visits_plot", branches, version),
+        lambda: comparison_visits_figure(data, list(branches), dates),
+    )
+
+
+view_cache = ViewCache()
+
+
+def cached_view(data, branch, dates):
+    # Sessions on the same branch and months share one view per data version
+    return view_cache.get_or_build(
+        (data.version, branch, *dates),
+        lambda: branch_data_for_dates(data, branch, dates),
+    )
+
+
+# Figures are built on this pool instead of the event loop, so one session's slow branch
+# doesn't freeze every other session on the worker. CPL_RENDER_THREADS=0 builds them inline.
+RENDER_THREADS = int(os.environ.get("CPL_RENDER_THREADS", "4"))
+render_pool = ThreadPoolExecutor(RENDER_THREADS, thread_name_prefix="cpl-render") if RENDER_THREADS else None
+
+# With the pool, a figure output (or the branch view) only picks up its task's result. The
+# build is timed in the pool under the same name instead, so each is recorded once, with its
+# real cost.
+timed_inline = (lambda fn: fn) if render_pool else timed
+
+
+# The logo and branch maps are served as files under content-hashed URLs, so browsers
+# cache them for good instead of getting them inlined into every render
+assets = AssetManifest()
+
+# First and last dates of the data the page is built with
+DATE_SPAN = store.current.date_span
+
 # Define UI
 app_ui = ui.page_fluid(
     ui.layout_sidebar(
         ui.sidebar(
-            ui.output_ui("cpllogo"),
+            assets.image("cpl-logo.svg", alt="Chicago Public Library", height="70px"),
 
             ui.input_select(
                 "branch", "Select branch",
-                choices=branch_names["branch_name"].unique().tolist(),
-                selected=branch_names["branch_name"].unique()[3]
+                choices=store.current.branches,
+                selected=store.current.branches[3]
+            ),
+
+            # Limits visits, physical reading, programs and checkouts to these months
+            ui.input_date_range(
+                "dates", "Months",
+                start=DATE_SPAN and DATE_SPAN[0], end=DATE_SPAN and DATE_SPAN[1],
+                min=DATE_SPAN and DATE_SPAN[0], max=DATE_SPAN and DATE_SPAN[1],
+                format="yyyy-mm", startview="year",
             ),
 
             # Map here
@@ -79,7 +619,7 @@ app_ui = ui.page_fluid(
                                 full_screen=True
                             ),
                             ui.card(
-                                ui.a("Checkouts by reading level since 2023"),
+                                ui.a("Checkouts by reading level ", ui.output_text("reading_level_period", inline=True)),
                                 output_widget("reading_level_donut_chart"),
                                 ui.output_data_frame("top_reading_level_table"),
                                 full_screen=True
@@ -88,21 +628,31 @@ app_ui = ui.page_fluid(
                         ),
                         ui.layout_columns(
                             ui.card(
-                                ui.a("Top genres checked out since 2023"),
-                                ui.output_data_frame("top_genres_table"),
+                                ui.a("Top genres checked out ", ui.output_text("top_genres_period", inline=True)),
+                                paged_table_ui("top_genres_table", "Filter genres"),
                                 full_screen=True
                             ),
                             ui.card(
-                                ui.a("Top books checked out since 2023"),
-                                ui.output_data_frame("top_books_table"),
+                                ui.a("Top books checked out ", ui.output_text("top_books_period", inline=True)),
+                                paged_table_ui("top_books_table", "Filter titles"),
                                 full_screen=True
                             ),
                             ui.card(
-                                ui.a("Top DVDs checked out since 2023"),
-                                ui.output_data_frame("top_dvds_table"),
+                                ui.a("Top DVDs checked out ", ui.output_text("top_dvds_period", inline=True)),
+                                paged_table_ui("top_dvds_table", "Filter titles"),
                                 full_screen=True
                             ),
                             col_widths=[4,4,4]
+                        ),
+                        ui.card(
+                            ui.a("Search titles across all branches"),
+                            ui.layout_columns(
+                                ui.input_text("title_search", None, placeholder="Title words, e.g. hunger games"),
+                                ui.output_text("title_search_summary"),
+                                col_widths=[6,6]
+                            ),
+                            ui.output_data_frame("title_search_table"),
+                            full_screen=True
                         )
                      
                      ),
@@ -152,6 +702,34 @@ app_ui = ui.page_fluid(
                         )
 
                      ),
+        ui.nav_panel("Compare branches",
+            ui.h4("Compare branches"),
+            ui.layout_columns(
+                ui.input_selectize(
+                    "compare_branches", "Branches to compare",
+                    choices=store.current.branches,
+                    selected=store.current.branches[:3],
+                    multiple=True
+                ),
+                ui.input_switch("compare_all", "All branches"),
+                col_widths=[9,3]
+            ),
+            ui.card(
+                ui.a("Visits, checkouts and programs, with each branch's percentile across all branches"),
+                ui.output_data_frame("comparison_table"),
+                full_screen=True
+            ),
+            ui.card(
+                output_widget("comparison_visits_plot"),
+                full_screen=True
+            ),
+        ),
+        # Only present when instrumentation is on (CPL_INSTRUMENT=1)
+        *([ui.nav_panel("Diagnostics",
+            ui.h4("Render timings"),
+            ui.output_data_frame("diagnostics_table"),
+            ui.output_code("figure_cache_stats"),
+        )] if INSTRUMENTED else []),
         id="tab",  
         ),       
     ),
@@ -160,440 +738,416 @@ app_ui = ui.page_fluid(
 
 # Define server
 def server(input, output, session):
-    @render.image
-    def image():
-        from pathlib import Path
-        dir = Path(__file__).resolve().parent
-        img = {"src": str(dir / "cplbranches/cpl-logo.svg"), "height":'70px', "style":"height='10px' !important"}
-        return img
-    
-    @render.image
-    def map_image():
-        from pathlib import Path
-        base_dir = Path(__file__).resolve().parent
-        map_dir = base_dir / "cplbranches/maps"
+    # Every output reads the data through this calc, so when the background loader swaps
+    # in a new version they all refresh
+    @reactive.poll(lambda: store.current.version, DATA_POLL_SECS)
+    def data():
+        return store.current
 
-        # Sanitize and format filename (ensure branch input matches file naming)
-        branch_name = input.branch().replace(" ", "_")  # adapt if more cleaning is needed
-        filename = f"map_{branch_name}.png"
-        full_path = map_dir / filename
+    # The months picked, or None when they cover all the data
+    @reactive.Calc
+    @timed
+    def dates():
+        return months_in(data(), input.dates())
 
-        if not full_path.exists():
-            return {"src": "", "alt": f"Map not found: {filename}"}
+    # Views are built on the render pool too, since a branch's tables take a while to sort
+    requested_view = None
 
-        return {
-            "src": str(full_path),
-            "width": "100%",  # or a fixed width like "800px"
-            "style": "border: 1px solid #ccc;"
-        }
+    @reactive.extended_task
+    async def view_task(current, branch, picked):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(render_pool, timed_call, "branch_data", cached_view, current, branch, picked)
+
+    # Runs ahead of the figure tasks, which read the view it starts
+    @reactive.effect(priority=2)
+    def _start_view():
+        nonlocal requested_view
+        if not render_pool or dates() is None:
+            return
+        key = (data().version, input.branch(), dates())
+        if key == requested_view:
+            return
+        requested_view = key
+        view_task.cancel()
+        view_task.invoke(data(), input.branch(), dates())
+
+    # What the branch's dated figures and tables are built from: the data version itself,
+    # or a view of the branch limited to the picked months
+    @reactive.Calc
+    @timed_inline
+    def branch_data():
+        if dates() is None:
+            return data()
+        if not render_pool:
+            return cached_view(data(), input.branch(), dates())
+        # Shows the outputs as recalculating until the view is ready
+        return view_task.result()
+
+    @reactive.effect
+    @reactive.event(data, ignore_init=True)
+    def _update_branch_choices():
+        branches = data().branches
+        selected = input.branch() if input.branch() in branches else branches[0]
+        ui.update_select("branch", choices=branches, selected=selected)
+        compared = [branch for branch in input.compare_branches() if branch in branches]
+        ui.update_selectize("compare_branches", choices=branches, selected=compared)
+
+    # The page offers the months loaded at startup. When a data version reaches further,
+    # widen the input, and move its end along if it was on the latest month.
+    span = DATE_SPAN
+
+    @reactive.effect
+    def _update_date_span():
+        nonlocal span
+        new_span = data().date_span
+        if new_span is None or new_span == span:
+            return
+        with reactive.isolate():
+            picked = input.dates()
+        at_latest = span is None or not picked or picked[1] is None or (
+            pd.Timestamp(picked[1]).to_period("M") >= span[1].to_period("M")
+        )
+        ui.update_date_range(
+            "dates", min=new_span[0], max=new_span[1], end=new_span[1] if at_latest else None,
+            start=new_span[0] if span is None else None,
+        )
+        span = new_span
+
+    # What each figure is built from: a key that changes whenever the figure would, and the
+    # cached builder to call with its arguments
+    def figure_request(output_id):
+        if output_id == "comparison_visits_plot":
+            branches = tuple(sorted(compared_branches()))
+            return (branches, data().version, dates()), (cached_comparison_figure, branches, dates(), data())
+        current = branch_data() if output_id in DATED_FIGURES else data()
+        return (input.branch(), current.version), (cached_figure, output_id, input.branch(), current)
+
+    # One extended task per figure output. Picking another branch cancels the build in
+    # flight (the pool thread finishes, but its result is dropped) and starts the new one.
+    # Figures on a tab that isn't open wait until it is, and keep their last result, so
+    # reopening a tab without changing branch doesn't build anything.
+    def figure_task(output_id):
+        requested = None
+
+        @reactive.extended_task
+        async def build(build_figure, *args):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(render_pool, timed_call, output_id, build_figure, *args)
+
+        # Runs ahead of the outputs, so a reopened tab never shows another branch's figure
+        @reactive.effect(priority=1)
+        def _start():
+            nonlocal requested
+            tab = FIGURE_TABS.get(output_id)
+            if tab is not None and input.tab() != tab:
+                return
+            # Compared by version, since the data itself holds frames that can't be compared
+            key, call = figure_request(output_id)
+            if key == requested:
+                return
+            requested = key
+            build.cancel()
+            build.invoke(*call)
+
+        return build
+
+    figure_ids = [*FIGURE_BUILDERS, "comparison_visits_plot"]
+    figure_tasks = {output_id: figure_task(output_id) for output_id in figure_ids} if render_pool else {}
+
+    def figure(output_id):
+        if not figure_tasks:
+            build_figure, *args = figure_request(output_id)[1]
+            return build_figure(*args)
+        # Shows the output as recalculating until the task finishes
+        return figure_tasks[output_id].result()
 
     @render.ui
+    @timed
     def map():
-        return ui.output_image("map_image", height="70px")
+        # Sanitize and format filename (ensure branch input matches file naming)
+        branch_name = input.branch().replace(" ", "_")  # adapt if more cleaning is needed
+        filename = f"map_{branch_name}.png"
+        if assets.url(f"maps/{filename}") is None:
+            return ui.img(alt=f"Map not found: {filename}")
+        # Only the tag is sent; the browser fetches the map once and caches it
+        return assets.image(f"maps/{filename}", alt=f"Map of {input.branch()}", width="100%", style="border: 1px solid #ccc;")
 
-    @render.ui
-    def cpllogo():
-        return ui.output_image("image", height="70px")
+    @reactive.Calc
+    @timed
+    def census():
+        return data().census_records.get(input.branch())
 
     @render.text
+    @timed
     def median_income_display():
-        selected_branch = input.branch()
-        filtered_data = branch_service_census_food_data[
-            branch_service_census_food_data['branch_name'] == selected_branch
-        ]
-        
-        if not filtered_data.empty:
-            median_income_value = filtered_data['medianincome'].iloc[0]
-            if pd.notna(median_income_value):
-                return f"${median_income_value:,.2f}"
-            else:
-                return "Data not available"
-        else:
-            return "No data found"
+        return format_value(census(), *CENSUS_DISPLAYS["median_income_display"])
     
     @render.text
+    @timed
     def food_display():
-        selected_branch = input.branch()
-        filtered_data = branch_service_census_food_data[
-            branch_service_census_food_data['branch_name'] == selected_branch
-        ]
-        
-        if not filtered_data.empty:
-            food_value = filtered_data['overall_food_insecurity_rate'].iloc[0]
-            if pd.notna(food_value):
-                return f"{food_value:,.1%}"
-            else:
-                return "Data not available"
-        else:
-            return "No data found"
+        return format_value(census(), *CENSUS_DISPLAYS["food_display"])
 
     @render.text
+    @timed
     def unemployment_display():
-        selected_branch = input.branch()
-        filtered_data = branch_service_census_food_data[
-            branch_service_census_food_data['branch_name'] == selected_branch
-        ]
-        
-        if not filtered_data.empty:
-            unemployment_value = filtered_data['unemployment'].iloc[0]
-            if pd.notna(unemployment_value):
-                return f"{unemployment_value:,.1%}"
-            else:
-                return "Data not available"
-        else:
-            return "No data found"
+        return format_value(census(), *CENSUS_DISPLAYS["unemployment_display"])
 
     @render.text
+    @timed
     def uninsured_display():
-        selected_branch = input.branch()
-        filtered_data = branch_service_census_food_data[
-            branch_service_census_food_data['branch_name'] == selected_branch
-        ]
-        
-        if not filtered_data.empty:
-            uninsured_value = filtered_data['uninsured'].iloc[0]
-            if pd.notna(uninsured_value):
-                return f"{uninsured_value:,.1%}"
-            else:
-                return "Data not available"
-        else:
-            return "No data found"
+        return format_value(census(), *CENSUS_DISPLAYS["uninsured_display"])
 
     @render_plotly
+    @timed_inline
     def age_bar_chart():
-        census_data = branch_service_census_food_data[branch_service_census_food_data["branch_name"] == input.branch()]
-        age_columns = ['under10', 'age10to20', 'age20to40', 'age40to60', 'age60plus']
-        age_labels = ['<10', '10–19', '20–39', '40–59', '60+']
-        values = [census_data.iloc[0][col] for col in age_columns]
-        
-        age_bar_chart = go.Figure(data=[
-            go.Bar(x=age_labels, y=values)
-        ])
-        age_bar_chart.update_layout(
-            # title='Age distribution',
-            template='plotly_white'
-        )
-        return age_bar_chart
-    
+        return figure("age_bar_chart")
+
     @render_plotly
+    @timed_inline
     def race_bar_chart():
-        census_data = branch_service_census_food_data[branch_service_census_food_data["branch_name"] == input.branch()]
-        race_columns = ['black_pop', 'white_pop', 'asian_nhpi_pop', 'latino_pop']
-        race_labels = ['Black', 'White', 'Asian', 'Latino']
-        values = [census_data.iloc[0][col]*100 for col in race_columns]
-        
-        race_bar_chart = go.Figure(data=[
-            go.Bar(y=values, x=race_labels)
-        ])
-        race_bar_chart.update_layout(
-            template='plotly_white',
-            # xaxis_title='Population Proportion',
-            yaxis_title='',
-            margin=dict(l=0, r=10, t=10, b=10),
-            yaxis=dict(ticksuffix='%')
-        )
-        return race_bar_chart
+        return figure("race_bar_chart")
 
     @render_plotly
+    @timed_inline
     def visits_plot():
-        df_filtered = visits_data_all[visits_data_all["branch_name"] == input.branch()]
-        df_filtered = df_filtered.sort_values("month_date")
-        
-        fig = px.line(df_filtered, x="month_date", y="value", markers=True, title="layout.hovermode='x unified'")
-        fig.update_layout(
-            title_text='Monthly visits',
-            xaxis_title='',
-            yaxis_title='',
-            template='simple_white',
-            font=dict(size=12),
-            showlegend=False,
-            hovermode="x unified",
-            yaxis=dict(tickformat=','),
-            modebar=dict(remove=['zoom', 'pan', 'select'])
-        )
-        fig.update_traces(
-            mode="markers+lines",
-            hovertemplate=None,
-            line=dict(color="#2c3e50", width=1),
-            marker=dict(color="#2c3e50", size=6)
-        )
-        return fig
+        return figure("visits_plot")
 
     @render_plotly
+    @timed_inline
     def programs_plot():
-        df_filtered = public_calendar[public_calendar["branch_name"] == input.branch()]
-        result = df_filtered.groupby(['audiences']).agg(
-            avg_attendance=('actual_attendance', lambda x: x.mean(skipna=True)),
-            total_programs=('actual_attendance', 'count')).reset_index() 
-        
-        audience_order = [
-            "Children Ages 0-5",
-            "Children Ages 6-11",
-            "Teens Ages 12-18",
-            "Adults Ages 19+",
-            "Seniors",
-            "All Ages"
-        ]
-
-        result['audiences'] = pd.Categorical(result['audiences'], categories=audience_order, ordered=True)
-        result = result.sort_values('audiences')
-
-        fig = px.bar(
-                result,
-                x='audiences',
-                y='avg_attendance',
-                title='Average program attendance by age group'
-            )
-        
-        fig.update_layout(
-                xaxis_tickangle=-45,
-                showlegend=False,
-                template='simple_white',
-                yaxis_title='Average attendance',
-                xaxis_title='',
-                margin=dict(t=60, b=120)
-            )
-        return fig
+        return figure("programs_plot")
 
     @render_plotly
+    @timed_inline
     def scatter_plot():
-        # Filter data
-        df_filtered = public_calendar[
-            (public_calendar["branch_name"] == input.branch()) &
-            (public_calendar["actual_attendance"] < 100)
-        ]
+        return figure("scatter_plot")
 
-        # Create jittered scatterplot
-        fig = px.scatter(
-            df_filtered,
-            x="time_parsed",
-            y="actual_attendance",
-            hover_data={
-            "actual_attendance": True,
-            "title": True,
-            "time_parsed": False  # hide if already shown as x-axis
-        }
-        )
-
-        fig.update_traces(marker=dict(size=6, line=dict(width=0)))
-        fig.update_layout(
-            title="Start time vs. in-person attendance",
-            xaxis_title="Start time",
-            yaxis_title="Attendance",
-            template="simple_white"
-        )
-
-        return fig
+    @reactive.Calc
+    @timed
+    def computer_use():
+        return data().comp_use_records.get(input.branch())
 
     @render.ui
+    @timed
     def stations():
-        comp_filtered = comp_use[comp_use["branch_name"] == input.branch()]
-        if not comp_filtered.empty:
-            total_stations = comp_filtered['total_stations'].iloc[0]
-            if pd.notna(total_stations):
-                return f"{float(total_stations):,.0f}"
-            else:
-                return "Data not available"
-        else:
-            return "No data found"
+        return format_value(computer_use(), *COMPUTER_USE_DISPLAYS["stations"])
 
     @render.ui
+    @timed
     def sessions():
-        comp_filtered = comp_use[comp_use["branch_name"] == input.branch()]
-        if not comp_filtered.empty:
-            total_sessions = comp_filtered['total_sessions'].iloc[0]
-            if pd.notna(total_sessions):
-                return f"{float(total_sessions):,.0f}"
-            else:
-                return "Data not available"
-        else:
-            return "No data found"
+        return format_value(computer_use(), *COMPUTER_USE_DISPLAYS["sessions"])
 
     @render.ui
+    @timed
     def average_session_length():
-        comp_filtered = comp_use[comp_use["branch_name"] == input.branch()]
-        if not comp_filtered.empty:
-            average_session_length_min = comp_filtered['average_session_length_min'].iloc[0]
-            if pd.notna(average_session_length_min):
-                return f"{float(average_session_length_min):,.1f} minutes"
-            else:
-                return "Data not available"
-        else:
-            return "No data found"
+        return format_value(computer_use(), *COMPUTER_USE_DISPLAYS["average_session_length"])
 
     # Reading levels plot
+    @render_plotly
+    @timed_inline
+    def readinglevels_plot():
+        return figure("readinglevels_plot")
+
+    # The long tables are paged, sorted and filtered here; only the requested page is sent
+    def table_page(output_id):
+        table = branch_data().paged_tables[output_id][input.branch()]
+        column, _, direction = (input[f"{output_id}_sort"]() or "").partition(":")
+        page = int(input[f"{output_id}_page"]() or 1) - 1
+        return table.page(page, column or None, direction == "desc", input[f"{output_id}_filter"]() or "")
+
+    # Back to the first page whenever the rows being paged change
+    def reset_page(output_id):
+        @reactive.effect
+        @reactive.event(input.branch, input[f"{output_id}_filter"], input[f"{output_id}_sort"], ignore_init=True)
+        def _reset():
+            ui.update_numeric(f"{output_id}_page", value=1)
+
+    for output_id in PAGED_TABLES:
+        reset_page(output_id)
+
+    # Months in the Circulation headings, which follow the date range input
     @reactive.Calc
-    def filtered_branch_physical_reading():
-        return branch_physical_reading[branch_physical_reading["branch_name"] == input.branch()]
-    
-    @reactive.Calc
-    def reading_levels_data():
-        df = filtered_branch_physical_reading()
-        
-        long_df = df.melt(
-            id_vars=["branch_name", "month"],
-            value_vars=[col for col in df.columns if col.startswith("physical_item_")],
-            var_name="category",
-            value_name="count"
-        )
+    @timed
+    def period():
+        return circulation_period(data(), dates())
 
-        # Map category codes to labels
-        long_df["category"] = long_df["category"].map(category_map)
+    @render.text
+    @timed
+    def reading_level_period():
+        return period()
 
-        return long_df.dropna(subset=["count"])
+    @render.text
+    @timed
+    def top_genres_period():
+        return period()
+
+    @render.text
+    @timed
+    def top_books_period():
+        return period()
+
+    @render.text
+    @timed
+    def top_dvds_period():
+        return period()
 
-    @render_plotly
-    def readinglevels_plot():
-        data = reading_levels_data()
-        if data.empty:
-            return px.scatter(title="No data available for this branch.")
-
-        fig = px.area(
-            data,
-            x="month",
-            y="count",
-            color="category",
-            title="Physical item checkouts over time",
-            labels={"count": "Checkouts", "month": "Month", "category": "Category"}
-        )
-        fig.update_layout(
-            yaxis=dict(tickformat=","),
-            template='simple_white',
-            legend_title="Category"
-        )
-        return fig
-    
     #####
     # Top genres table 
     #####
     @reactive.Calc
-    def filtered_branch_titles():
-        return branch_titles_filtered[branch_titles_filtered["branch_name"] == input.branch()]
-
-    @reactive.Calc
+    @timed
     def genre_tbl():
-        df = filtered_branch_titles()
-        grouped = (
-            df.groupby(["genre"], as_index=False)
-              .agg(checkouts=('x_of_checkouts', 'sum'))
-        )
-        # Sort and get top 20 
-        top_genres = (
-            grouped.sort_values("checkouts", ascending=False)
-                   .head(20)
-        )
-        top_genres['rank'] = top_genres['checkouts'].rank(method='dense', ascending=False)
-        top_genres = top_genres.rename(columns={'rank':'Rank', 'genre':'Genre', 'checkouts':'Checkouts'})
-        new_order = ['Rank', 'Genre', 'Checkouts']
-        top_genres = top_genres[new_order]
-        return top_genres
+        return table_page("top_genres_table")
 
     @render.data_frame
+    @timed
     def top_genres_table():
-        return render.DataTable(genre_tbl(), height="600px")
+        return render.DataTable(genre_tbl()[0], height="600px")
+
+    @render.text
+    @timed
+    def top_genres_table_rows():
+        return page_summary(*genre_tbl())
 
     #####
     # top_reading_level_table
     #####
 
     @reactive.Calc
-    def summarized_readinglevel_data():
-        df = filtered_branch_titles()
-        grouped = (
-            df
-            .groupby(["branch_name", "reading_level_item_cat2"], as_index=False)
-            .agg(checkouts=('x_of_checkouts', 'sum'))
-        )
-        return grouped
-
-    @reactive.Calc
+    @timed
     def reading_levels_tbl():
-        df = summarized_readinglevel_data()
-        df = df[df["branch_name"] == input.branch()]
-        
-        # Get top 50 per branch
-        top_titles = df.sort_values("checkouts", ascending=False).head(50)
-        top_titles = top_titles.drop(columns=['branch_name'], axis=1)
-        top_titles = top_titles.rename(columns={'reading_level_item_cat2':'Reading level', 'title':'Title', 'checkouts':'Checkouts'})
-        return top_titles
+        return branch_data().circulation[BRANCH_TABLES["top_reading_level_table"]][input.branch()]
 
     @render.data_frame
+    @timed
     def top_reading_level_table():
         return render.DataTable(reading_levels_tbl(), height="200px")
 
     @render_widget
+    @timed_inline
     def reading_level_donut_chart():
-        df = reading_levels_tbl()
-        if df.empty:
-            return px.scatter(title="No data available for selected branch.")
-        
-        fig = px.pie(
-            df,
-            names="Reading level",
-            values="Checkouts",
-            hole=0.4,
-            title=""
-        )
-        fig.update_traces(textinfo="percent+label", pull=[0.03]*len(df))
-        fig.update_layout(showlegend=True)
-
-        return fig
+        return figure("reading_level_donut_chart")
 
     ####################
     # Top books table
     ####################
     @reactive.Calc
-    def summarized_data():
-        df = filtered_branch_titles()
-        grouped = (
-            df
-            .groupby(["branch_name", "material_type_item_cat1", "title"], as_index=False)
-            .agg(checkouts=('x_of_checkouts', 'sum'))
-        )
-        return grouped
-
-    @reactive.Calc
+    @timed
     def books_tbl():
-        df = summarized_data()
-        df = df[
-            (df["material_type_item_cat1"].isin(["BOOKS"])) &
-            (df["branch_name"] == input.branch())
-        ]
-        # Get top 50 per branch
-        top_titles = df.sort_values("checkouts", ascending=False).head(50)
-        top_titles = top_titles.drop(columns=['branch_name'], axis=1)
-        top_titles['rank'] = top_titles['checkouts'].rank(method='dense', ascending=False)
-        top_titles = top_titles.rename(columns={'rank':'Rank', 'material_type_item_cat1':'Category', 'title':'Title', 'checkouts':'Checkouts'})
-        new_order = ['Rank', 'Title', 'Category', 'Checkouts']
-        top_titles = top_titles[new_order]
-        return top_titles
-    
+        return table_page("top_books_table")
+
     @render.data_frame
+    @timed
     def top_books_table():
-        return render.DataTable(books_tbl(), height="600px")
+        return render.DataTable(books_tbl()[0], height="600px")
+
+    @render.text
+    @timed
+    def top_books_table_rows():
+        return page_summary(*books_tbl())
 
     ####################
     # Top DVDs table 
     ####################
     @reactive.Calc
+    @timed
     def dvds_tbl():
-        df = summarized_data()
-        df = df[
-            (df["material_type_item_cat1"].isin(["DVDS", "DVD-BLURAY"])) &
-            (df["branch_name"] == input.branch())
-        ]
-        # Get top 50 per branch
-        top_titles = df.sort_values("checkouts", ascending=False).head(50)
-        top_titles = top_titles.drop(columns=['branch_name'], axis=1)
-        top_titles['rank'] = top_titles['checkouts'].rank(method='dense', ascending=False)
-        top_titles = top_titles.rename(columns={'rank':'Rank', 'material_type_item_cat1':'Category', 'title':'Title', 'checkouts':'Checkouts'})
-        new_order = ['Rank', 'Title', 'Category', 'Checkouts']
-        top_titles = top_titles[new_order]
-        return top_titles
+        return table_page("top_dvds_table")
 
     @render.data_frame
+    @timed
     def top_dvds_table():
-        return render.DataTable(dvds_tbl(), height="600px")
+        return render.DataTable(dvds_tbl()[0], height="600px")
+
+    @render.text
+    @timed
+    def top_dvds_table_rows():
+        return page_summary(*dvds_tbl())
+
+    ####################
+    # Title search
+    ####################
+    @reactive.Calc
+    @timed
+    def title_search_results():
+        return title_search_data(data(), input.title_search() or "")
+
+    @render.data_frame
+    @timed
+    def title_search_table():
+        return render.DataTable(title_search_results()[0], height="400px")
+
+    @render.text
+    @timed
+    def title_search_summary():
+        table, matched = title_search_results()
+        if not (input.title_search() or "").strip():
+            return ""
+        if not matched:
+            return "No matching titles"
+        shown = table["Title"].nunique()
+        summary = f"{matched:,} matching title" + ("s" if matched > 1 else "")
+        return summary + (f", top {shown} shown" if shown < matched else "")
+
+    # Compare branches tab
+    @reactive.Calc
+    @timed
+    def compared_branches():
+        if input.compare_all():
+            return data().branches
+        return list(input.compare_branches())
+
+    @render.data_frame
+    @timed
+    def comparison_table():
+        return render.DataTable(comparison_data(data(), compared_branches(), dates()), height="400px")
+
+    @render_plotly
+    @timed_inline
+    def comparison_visits_plot():
+        return figure("comparison_visits_plot")
+
+    if INSTRUMENTED:
+        @render.data_frame
+        def diagnostics_table():
+            reactive.invalidate_later(5)
+            return render.DataTable(metrics.summary(), height="600px")
+
+        @render.code
+        def figure_cache_stats():
+            reactive.invalidate_later(5)
+            stats = {**figure_cache.stats(), **{f"view_{key}": value for key, value in view_cache.stats().items()}}
+            return "\n".join(f"{key}: {value}" for key, value in stats.items())
 
 # Create the app
-app = App(app_ui, server)
+app = with_static_assets(App(app_ui, server), assets)
+
+# With instrumentation on, also serve the timings at /metrics in Prometheus format
+if INSTRUMENTED:
+    app = with_metrics_route(
+        app,
+        gauges=lambda: {
+            **{f"cpl_figure_cache_{key}": value for key, value in figure_cache.stats().items()},
+            **{f"cpl_view_cache_{key}": value for key, value in view_cache.stats().items()},
+        },
+    )
+
+# Optional prewarm: CPL_PREWARM=1 builds every branch's figures at startup, and
+# CPL_PREWARM=<n> does it with n worker processes. Pool workers skip this themselves.
+PREWARM_WORKERS = int(os.environ.get("CPL_PREWARM") or 0)
+if PREWARM_WORKERS and not in_prewarm_worker():
+    prewarm(FIGURE_BUILDERS, figure_cache, store.current, workers=PREWARM_WORKERS)
+
+
+# Figures and views from older versions can't be requested again once a new version is in
+@store.on_change
+def _refresh_figures(old, new):
+    figure_cache.clear()
+    view_cache.clear()
+    if PREWARM_WORKERS and not in_prewarm_worker():
+        prewarm(FIGURE_BUILDERS, figure_cache, new, workers=PREWARM_WORKERS)
+
+
+# Every server worker watches the data directory itself and swaps in new versions
+if DATA_WATCH_SECS > 0:
+    store.watch(DATA_WATCH_SECS)
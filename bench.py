@@ -0,0 +1,326 @@
+"""Benchmark data loading and per-output render cost on synthetic data.
+
+    python bench.py                      # 1x, 10x and 100x title/calendar rows
+    python bench.py --scales 1 10 --branches 80 --repeat 3 --json bench.json
+
+For each scale this writes synthetic CSVs, then in a fresh interpreter imports app.py
+against them (timing the CSV load and the cached load separately) and calls every
+output function for every branch through a stub session, with no browser involved.
+Reported per output: p50/p95 latency on a cold figure cache, on a warm one and with a
+year's months picked in the date range, peak Python memory allocated while rendering,
+and the size of the serialized payload. Outputs that raise are listed after the table,
+and make the run exit non-zero.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import tracemalloc
+import types
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import output_size
+
+# Row counts at scale 1; titles and calendar events grow with the scale
+BASE_TITLE_ROWS = 200_000
+BASE_CALENDAR_ROWS = 20_000
+MONTHS = pd.date_range("2019-01-01", "2024-12-01", freq="MS")
+# Months picked in the date range pass, so the per-range views are measured too
+DATED_RANGE = (MONTHS[-12].strftime("%Y-%m-%d"), MONTHS[-1].strftime("%Y-%m-%d"))
+AUDIENCES = ["Children Ages 0-5", "Children Ages 6-11", "Teens Ages 12-18", "Adults Ages 19+", "Seniors", "All Ages"]
+MATERIALS = ["BOOKS", "DVDS", "DVD-BLURAY", "SOUND DISC", "MAGAZINE"]
+READING_LEVELS = ["ADULT", "YOUNG ADULT", "JUVENILE"]
+
+
+def synthetic_data(data_dir, scale=1, branches=80, seed=0):
+    """Write the seven CSVs app.py loads, filled with random but realistically shaped data."""
+    rng = np.random.default_rng(seed)
+    data_dir = Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    names = [f"Branch {i:02d}" for i in range(branches)]
+
+    pd.DataFrame({"branch_name": names}).to_csv(data_dir / "branch_names_crosswalk.csv", index=False)
+
+    per_month = pd.MultiIndex.from_product([names, MONTHS.strftime("%Y-%m-%d")], names=["branch_name", "month"])
+    visits = per_month.to_frame(index=False).rename(columns={"month": "month_date"})
+    visits["value"] = rng.integers(500, 20_000, len(visits))
+    visits.to_csv(data_dir / "visits_data_all.csv", index=False)
+
+    reading = per_month.to_frame(index=False)
+    for col in ["physical_item_adult", "physical_item_ya", "physical_item_juvenile"]:
+        reading[col] = rng.integers(100, 5_000, len(reading))
+    reading.to_csv(data_dir / "branch_physical_reading_fix.csv", index=False)
+
+    n = BASE_CALENDAR_ROWS * scale
+    attendance = rng.integers(0, 150, n).astype(float)
+    attendance[rng.random(n) < 0.1] = np.nan
+    hours = rng.integers(8, 21, n)
+    minutes = rng.choice([0, 15, 30, 45], n)
+    pd.DataFrame({
+        "branch_name": rng.choice(names, n),
+        "title": np.char.add("Program ", rng.integers(0, 2_000, n).astype(str)),
+        "audiences": rng.choice(AUDIENCES, n),
+        "actual_attendance": attendance,
+        "time_parsed": [f"{h:02d}:{m:02d}:00" for h, m in zip(hours, minutes)],
+        "start_date": (MONTHS[0] + pd.to_timedelta(rng.integers(0, (MONTHS[-1] - MONTHS[0]).days + 31, n), unit="D")).strftime("%Y-%m-%d"),
+    }).to_csv(data_dir / "public_calendar.csv", index=False)
+
+    census = pd.DataFrame({"branch_name": names})
+    census["medianincome"] = rng.integers(20_000, 150_000, branches)
+    for col in ["overall_food_insecurity_rate", "unemployment", "uninsured"]:
+        census[col] = rng.random(branches) * 0.3
+    for col in ["under10", "age10to20", "age20to40", "age40to60", "age60plus"]:
+        census[col] = rng.integers(500, 20_000, branches)
+    for col in ["black_pop", "white_pop", "asian_nhpi_pop", "latino_pop"]:
+        census[col] = rng.random(branches) * 0.5
+    census.to_csv(data_dir / "branch_service_census_food_data.csv", index=False)
+
+    pd.DataFrame({
+        "branch_name": names,
+        "total_stations": rng.integers(5, 60, branches),
+        "total_sessions": rng.integers(1_000, 100_000, branches),
+        "average_session_length_min": rng.random(branches) * 90,
+    }).to_csv(data_dir / "branch_computer_use.csv", index=False)
+
+    n = BASE_TITLE_ROWS * scale
+    pd.DataFrame({
+        "branch_name": rng.choice(names, n),
+        "title": np.char.add("Title ", rng.zipf(1.3, n).clip(max=500_000).astype(str)),
+        "material_type_item_cat1": rng.choice(MATERIALS, n, p=[0.6, 0.15, 0.1, 0.1, 0.05]),
+        "reading_level_item_cat2": rng.choice(READING_LEVELS, n),
+        "genre": np.char.add("Genre ", rng.integers(0, 150, n).astype(str)),
+        "checkout_month": rng.choice(MONTHS.strftime("%Y-%m-%d"), n),
+        "x_of_checkouts": rng.integers(1, 40, n),
+    }).to_csv(data_dir / "branch_titles_filtered.csv", index=False)
+
+
+class StubInputs(types.SimpleNamespace):
+    # Inputs not given here read as None, like inputs the browser hasn't sent yet
+    def __getitem__(self, name):
+        return getattr(self, name, lambda: None)
+
+
+def branch_outputs(app, branch, tab="Circulation", dates=None):
+    """Run server() for one branch in a stub session and return its renderers by output id."""
+    from shiny.module import ResolvedId
+    from shiny.session import Session, session_context
+
+    renderers = {}
+
+    def register(renderer, **kwargs):
+        renderers[renderer.__name__] = renderer
+        return renderer
+
+    # Every Session method is a no-op. As a stub session, shiny and shinywidgets don't set
+    # up effects or widget comms for it, since no browser is attached.
+    session = mock.Mock(spec=Session)
+    session.is_stub_session.return_value = True
+    session.ns = ResolvedId("")
+    session.output = register
+    session.input = StubInputs(
+        branch=lambda: branch, tab=lambda: tab, compare_branches=lambda: [branch], compare_all=lambda: False,
+        title_search=lambda: "", dates=lambda: dates,
+    )
+    with session_context(session):
+        app.server(session.input, session.output, session)
+    return session, renderers
+
+
+def render_output(session, renderer):
+    from shiny import reactive
+    from shiny.session import session_context
+
+    with session_context(session), reactive.isolate():
+        return asyncio.run(renderer.fn())
+
+
+def _record_failure(failures, output_id, branch, error):
+    # req() and friends leave an output blank on purpose; anything else is a broken output
+    from shiny.types import SilentException
+
+    if isinstance(error, SilentException):
+        return
+    failure = failures.setdefault(output_id, {"branches": 0, "first_branch": branch, "error": ""})
+    failure["branches"] += 1
+    failure["error"] = failure["error"] or "".join(traceback.format_exception_only(error)).strip()
+
+
+def _percentiles(samples):
+    if not samples:
+        return None, None
+    return float(np.percentile(samples, 50)), float(np.percentile(samples, 95))
+
+
+def run_scale(repeat):
+    """Measure one scale inside this interpreter; CPL_DATA_DIR points at the synthetic data."""
+    start = time.perf_counter()
+    import app
+    load_s = time.perf_counter() - start
+    rss_after_load = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    branches = app.store.current.branches
+    cold, warm, dated, peak, payload, switch, failures = {}, {}, {}, {}, {}, [], {}
+
+    for attempt in range(repeat + 1):
+        if attempt == 0:
+            app.figure_cache.clear()
+        for branch in branches:
+            switch_start = time.perf_counter()
+            session, renderers = branch_outputs(app, branch)
+            for output_id, renderer in renderers.items():
+                t0 = time.perf_counter()
+                try:
+                    value = render_output(session, renderer)
+                except Exception as error:
+                    if attempt == 0:
+                        _record_failure(failures, output_id, branch, error)
+                    continue
+                elapsed = time.perf_counter() - t0
+                (cold if attempt == 0 else warm).setdefault(output_id, []).append(elapsed)
+                payload.setdefault(output_id, []).append(output_size(value))
+            if attempt == 0:
+                switch.append(time.perf_counter() - switch_start)
+
+    # Every branch again with DATED_RANGE picked, built from the date indexes
+    for branch in branches:
+        session, renderers = branch_outputs(app, branch, dates=DATED_RANGE)
+        for output_id, renderer in renderers.items():
+            t0 = time.perf_counter()
+            try:
+                render_output(session, renderer)
+            except Exception as error:
+                _record_failure(failures, output_id, branch, error)
+                continue
+            dated.setdefault(output_id, []).append(time.perf_counter() - t0)
+
+    # Separate pass for allocations, so tracing doesn't skew the timings above
+    app.figure_cache.clear()
+    tracemalloc.start()
+    for branch in branches:
+        session, renderers = branch_outputs(app, branch)
+        for output_id, renderer in renderers.items():
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            try:
+                render_output(session, renderer)
+            except Exception:
+                # Already recorded by the timed passes
+                continue
+            peak[output_id] = max(peak.get(output_id, 0), tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    outputs = {}
+    for output_id in payload:
+        outputs[output_id] = {
+            "cold_p50_ms": None, "cold_p95_ms": None, "warm_p50_ms": None, "warm_p95_ms": None,
+            "dated_p50_ms": None, "dated_p95_ms": None,
+            "peak_alloc_kb": peak.get(output_id, 0) / 1024,
+            "payload_kb_p50": float(np.percentile(payload[output_id], 50)) / 1024,
+            "payload_kb_max": max(payload[output_id]) / 1024,
+        }
+        for label, samples in (("cold", cold), ("warm", warm), ("dated", dated)):
+            p50, p95 = _percentiles(samples.get(output_id, []))
+            if p50 is not None:
+                outputs[output_id][f"{label}_p50_ms"] = p50 * 1000
+                outputs[output_id][f"{label}_p95_ms"] = p95 * 1000
+
+    switch_p50, switch_p95 = _percentiles(switch)
+    return {
+        "load_s": load_s,
+        "rows": {"titles": len(app.store.current.branch_titles_filtered), "calendar": len(app.store.current.public_calendar)},
+        "branches": len(branches),
+        "branch_switch_p50_ms": switch_p50 * 1000,
+        "branch_switch_p95_ms": switch_p95 * 1000,
+        "rss_after_load_mb": rss_after_load / 1024,
+        "rss_peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "outputs": outputs,
+        "failures": failures,
+    }
+
+
+def _in_subprocess(data_dir, *args):
+    # Figures are built inline, so each render call measures the full build
+    env = dict(os.environ, CPL_DATA_DIR=str(data_dir), CPL_WATCH_DATA="0", CPL_RENDER_THREADS="0")
+    env.pop("CPL_PREWARM", None)
+    result = subprocess.run(
+        [sys.executable, __file__, *args], env=env, check=True, capture_output=True, text=True,
+        cwd=Path(__file__).resolve().parent,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _fmt(value, spec=".1f"):
+    return "-" if value is None else format(value, spec)
+
+
+def print_report(scale, result):
+    print(f"\n== scale {scale}x: {result['rows']['titles']:,} title rows, "
+          f"{result['rows']['calendar']:,} calendar rows, {result['branches']} branches")
+    print(f"load from CSV {result['csv_load_s']:.2f}s, from cache {result['load_s']:.2f}s; "
+          f"RSS after load {result['rss_after_load_mb']:.0f} MB, peak {result['rss_peak_mb']:.0f} MB")
+    print(f"branch switch (all outputs, cold) p50 {result['branch_switch_p50_ms']:.1f} ms, "
+          f"p95 {result['branch_switch_p95_ms']:.1f} ms")
+    header = (f"{'output':<28}{'cold p50':>10}{'cold p95':>10}{'warm p50':>10}{'warm p95':>10}"
+              f"{'dated p50':>11}{'dated p95':>11}{'peak KB':>10}{'payload KB':>12}")
+    print(header)
+    print("-" * len(header))
+    for output_id, row in sorted(result["outputs"].items()):
+        print(f"{output_id:<28}{_fmt(row['cold_p50_ms']):>10}{_fmt(row['cold_p95_ms']):>10}"
+              f"{_fmt(row['warm_p50_ms']):>10}{_fmt(row['warm_p95_ms']):>10}"
+              f"{_fmt(row['dated_p50_ms']):>11}{_fmt(row['dated_p95_ms']):>11}"
+              f"{_fmt(row['peak_alloc_kb'], '.0f'):>10}{_fmt(row['payload_kb_max']):>12}")
+    for output_id, failure in sorted(result["failures"].items()):
+        print(f"FAILED {output_id} on {failure['branches']} branches (first {failure['first_branch']}): {failure['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CPL branch dashboard on synthetic data")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--branches", type=int, default=80)
+    parser.add_argument("--repeat", type=int, default=2, help="warm passes over every branch")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--keep-data", help="write the synthetic data here instead of a temp dir")
+    parser.add_argument("--run-scale", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--import-only", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.import_only:
+        start = time.perf_counter()
+        import app  # noqa: F401
+        print(json.dumps({"load_s": time.perf_counter() - start}))
+        return
+    if args.run_scale:
+        print(json.dumps(run_scale(args.repeat)))
+        return
+
+    results = {}
+    for scale in args.scales:
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = Path(args.keep_data or tmp) / f"scale{scale}"
+            synthetic_data(data_dir, scale, args.branches)
+            # First import parses the CSVs and writes the columnar cache; the measured run reuses it
+            csv_load = _in_subprocess(data_dir, "--import-only")["load_s"]
+            result = _in_subprocess(data_dir, "--run-scale", "--repeat", str(args.repeat))
+            result["csv_load_s"] = csv_load
+        results[scale] = result
+        print_report(scale, result)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    # A broken output fails the run instead of just dropping out of the report
+    if any(result["failures"] for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR = Path(os.environ.get("CPL_DATA_DIR", "cplbranches/data"))
+CACHE_DIR_NAME = ".cache"
+
+# Source CSVs, keyed by the name app.py gives each frame
+DATA_FILES = {
+    "branch_names": "branch_names_crosswalk.csv",
+    "visits_data_all": "visits_data_all.csv",
+    "public_calendar": "public_calendar.csv",
+    "branch_service_census_food_data": "branch_service_census_food_data.csv",
+    "comp_use": "branch_computer_use.csv",
+    "branch_titles_filtered": "branch_titles_filtered.csv",
+    "branch_physical_reading": "branch_physical_reading_fix.csv",
+}
+
+# Sources that grow a month at a time, with the column holding the month. New months are
+# added as delta CSVs under <data dir>/deltas/<CSV name>/ (see ingest.py) and appended to
+# the source's rows when it is loaded, so the base CSV never has to be replaced.
+APPENDABLE = {
+    "visits_data_all": "month_date",
+    "branch_physical_reading": "month",
+    "branch_titles_filtered": "checkout_month",
+}
+DELTA_DIR_NAME = "deltas"
+
+# Column types fixed when a CSV is parsed, so the cached copy already carries them:
+#   "category"  repeated strings, stored as integer codes plus one copy of each value
+#   "text"      mostly distinct strings such as titles; "category" normally, but Arrow strings
+#               in shared mode, where a category's values would be decoded into every worker
+#   "numeric"   numbers that need coercing, kept as float64
+#   "count"     counts, downcast to the smallest integer type (float32 if any are missing)
+#   "date"      calendar dates, parsed to datetime64
+#   "time"      times of day, parsed to datetime64 on a fixed date so they sort and plot in order
+SCHEMAS = {
+    "visits_data_all": {"branch_name": "category", "month_date": "date", "value": "count"},
+    "public_calendar": {
+        "branch_name": "category",
+        "audiences": "category",
+        "title": "text",
+        "actual_attendance": "count",
+        "time_parsed": "time",
+        "start_date": "date",
+    },
+    "branch_service_census_food_data": {"branch_name": "category", "medianincome": "numeric"},
+    "comp_use": {"branch_name": "category"},
+    "branch_titles_filtered": {
+        "branch_name": "category",
+        "title": "text",
+        "genre": "category",
+        "material_type_item_cat1": "category",
+        "reading_level_item_cat2": "category",
+        "checkout_month": "date",
+        "x_of_checkouts": "count",
+    },
+    "branch_physical_reading": {
+        "branch_name": "category",
+        "month": "date",
+        "physical_item_adult": "count",
+        "physical_item_ya": "count",
+        "physical_item_juvenile": "count",
+    },
+}
+
+# Every "time" column is placed on this date
+TIME_OF_DAY_DATE = pd.Timestamp("1900-01-01")
+
+# Bump when the way frames are parsed changes, so existing cache files are rebuilt
+CACHE_FORMAT = 5
+
+# Shared mode (CPL_SHARED_DATA=1): cache files are written uncompressed and every worker
+# memory-maps them read-only, so the column data sits once in the host's page cache
+# instead of once per worker process. Needs pyarrow.
+SHARED = os.environ.get("CPL_SHARED_DATA", "") not in ("", "0")
+
+
+def _count(values):
+    values = pd.to_numeric(values, errors="coerce")
+    if values.isna().any():
+        return values.astype("float32")
+    return pd.to_numeric(values, downcast="integer")
+
+
+def _time_of_day(values):
+    # Accepts bare times ("18:45:00") as well as full timestamps; only the time is kept
+    parsed = pd.to_datetime(values, errors="coerce", format="mixed")
+    return parsed - parsed.dt.normalize() + TIME_OF_DAY_DATE
+
+
+def _text(values):
+    if SHARED:
+        try:
+            import pyarrow as pa
+        except ImportError:
+            pass
+        else:
+            # The same type read_shared maps string columns to, so deltas concatenate cleanly
+            return values.astype(pd.ArrowDtype(pa.string()))
+    return values if isinstance(values.dtype, pd.CategoricalDtype) else values.astype("category")
+
+
+CONVERTERS = {
+    "numeric": lambda values: pd.to_numeric(values, errors="coerce"),
+    "count": _count,
+    "date": lambda values: pd.to_datetime(values, errors="coerce"),
+    "time": _time_of_day,
+    "text": _text,
+}
+
+
+def apply_schema(df, schema):
+    """Convert df's columns to the types schema declares; columns it lacks are skipped."""
+    for col, kind in schema.items():
+        if col not in df.columns:
+            continue
+        if kind == "category":
+            if not isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype("category")
+        else:
+            df[col] = CONVERTERS[kind](df[col])
+    return df
+
+
+def read_source(name, data_dir=DATA_DIR, path=None):
+    """Parse one source CSV (or one of its deltas, given path) and apply its schema."""
+    schema = SCHEMAS.get(name, {})
+    dtypes = {col: "category" for col, kind in schema.items() if kind == "category" or (kind == "text" and not SHARED)}
+    df = apply_schema(pd.read_csv(path or Path(data_dir) / DATA_FILES[name], dtype=dtypes), schema)
+
+    # Store branch-level frames grouped by branch, so BranchPartition can slice them as
+    # they are instead of sorting (and copying) them in every worker
+    if schema.get("branch_name") == "category":
+        df = df.sort_values("branch_name", kind="stable", ignore_index=True)
+    return df
+
+
+def delta_dir(name, data_dir=DATA_DIR):
+    return Path(data_dir) / DELTA_DIR_NAME / Path(DATA_FILES[name]).stem
+
+
+def delta_paths(name, data_dir=DATA_DIR):
+    """Delta CSVs added to a source, oldest first."""
+    if name not in APPENDABLE:
+        return []
+    return sorted(delta_dir(name, data_dir).glob("*.csv"))
+
+
+def source_state(name, data_dir=DATA_DIR):
+    """Size and mtime of a source's CSV followed by those of its deltas."""
+    parts = []
+    for path in [Path(data_dir) / DATA_FILES[name], *delta_paths(name, data_dir)]:
+        stat = path.stat()
+        parts.append(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return tuple(parts)
+
+
+def data_version(data_dir=DATA_DIR):
+    """Short fingerprint of the source CSVs and deltas; changes whenever any of them does."""
+    parts = [part for name in sorted(DATA_FILES) for part in source_state(name, data_dir)]
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:12]
+
+
+def concat_rows(frames):
+    """pd.concat for frames of the same source that keeps categorical columns categorical."""
+    frames = list(frames)
+    for col in frames[0].columns:
+        if isinstance(frames[0][col].dtype, pd.CategoricalDtype):
+            # Existing codes stay put; values first seen in later frames are added at the end
+            categories = frames[0][col].cat.categories
+            for df in frames[1:]:
+                categories = categories.union(df[col].cat.categories, sort=False)
+            frames = [df.assign(**{col: df[col].cat.set_categories(categories)}) for df in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def append_rows(df, deltas):
+    """df followed by the rows of deltas, regrouped by branch if df is grouped by branch."""
+    df = concat_rows([df, *deltas])
+    if "branch_name" in df and isinstance(df["branch_name"].dtype, pd.CategoricalDtype):
+        df = df.sort_values("branch_name", kind="stable", ignore_index=True)
+    return df
+
+
+def cache_path(name, data_dir=DATA_DIR, cache_dir=None):
+    """Location of the columnar copy of a source CSV, keyed by the CSV's size and mtime."""
+    source = Path(data_dir) / DATA_FILES[name]
+    stat = source.stat()
+    key = f"{CACHE_FORMAT}:{SHARED}:{stat.st_size}:{stat.st_mtime_ns}:{sorted(SCHEMAS.get(name, {}).items())}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+    cache_dir = Path(cache_dir) if cache_dir is not None else Path(data_dir) / CACHE_DIR_NAME
+    return cache_dir / f"{source.stem}-{digest}.feather"
+
+
+def write_cache(name, df, data_dir=DATA_DIR, cache_dir=None):
+    path = cache_path(name, data_dir, cache_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Write under a temporary name and rename, so workers starting at the same time never
+    # read a half-written file
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    df.reset_index(drop=True).to_feather(tmp, compression="uncompressed" if SHARED else "lz4")
+    os.replace(tmp, path)
+
+    # Drop copies built from older versions of the same CSV
+    for stale in path.parent.glob(f"{Path(DATA_FILES[name]).stem}-*.feather"):
+        if stale != path:
+            stale.unlink(missing_ok=True)
+    return path
+
+
+def _arrow_strings(arrow_type):
+    import pyarrow as pa
+
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.ArrowDtype(arrow_type)
+    return None
+
+
+def read_shared(path):
+    """Memory-map an uncompressed cache file without copying its columns.
+
+    String columns stay Arrow-backed and numeric columns become views of the mapping, so
+    every worker reading the same file shares the same physical pages. Categorical codes
+    are small and are copied.
+    """
+    import pyarrow as pa
+
+    table = pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+    return table.to_pandas(split_blocks=True, types_mapper=_arrow_strings)
+
+
+def _read_cache(path):
+    return read_shared(path) if SHARED else pd.read_feather(path)
+
+
+def load_frame(name, data_dir=DATA_DIR, cache_dir=None, use_cache=True):
+    """Load a source with any deltas appended to it."""
+    df = _load_base(name, data_dir, cache_dir, use_cache)
+    deltas = delta_paths(name, data_dir)
+    if deltas:
+        df = append_rows(df, [read_source(name, data_dir, path) for path in deltas])
+    return df
+
+
+def _load_base(name, data_dir=DATA_DIR, cache_dir=None, use_cache=True):
+    # From the columnar cache, falling back to (and refreshing from) the CSV
+    if not use_cache:
+        return read_source(name, data_dir)
+
+    path = cache_path(name, data_dir, cache_dir)
+    try:
+        return _read_cache(path)
+    except (ImportError, OSError, ValueError):
+        # Missing or stale cache file, or pyarrow isn't installed
+        pass
+
+    df = read_source(name, data_dir)
+    try:
+        path = write_cache(name, df, data_dir, cache_dir)
+        if SHARED:
+            # Map the file just written, so the first worker shares it too
+            return read_shared(path)
+    except (ImportError, OSError, ValueError):
+        pass
+    return df
+
+
+def build_cache(data_dir=DATA_DIR, cache_dir=None):
+    """Convert every source CSV into its columnar cache file."""
+    for name in DATA_FILES:
+        start = time.perf_counter()
+        df = read_source(name, data_dir)
+        path = write_cache(name, df, data_dir, cache_dir)
+        print(f"{DATA_FILES[name]} -> {path} ({len(df):,} rows, {time.perf_counter() - start:.2f}s)")
+
+
+def memory_report(data_dir=DATA_DIR):
+    """Memory held by each frame when parsed with pandas' defaults and with its schema."""
+    rows = []
+    for name, filename in DATA_FILES.items():
+        plain = pd.read_csv(Path(data_dir) / filename)
+        typed = read_source(name, data_dir)
+        rows.append({
+            "file": filename,
+            "rows": len(typed),
+            "default_mb": plain.memory_usage(deep=True).sum() / 2**20,
+            "schema_mb": typed.memory_usage(deep=True).sum() / 2**20,
+        })
+    report = pd.DataFrame(rows)
+    report.loc[len(report)] = ["total", report["rows"].sum(), report["default_mb"].sum(), report["schema_mb"].sum()]
+    return report
+
+
+class BranchPartition:
+    """Rows of a frame sorted by branch once at load time, with one offset range per branch.
+
+    Looking up a branch slices its contiguous block instead of scanning every row with
+    a boolean mask, and rows keep their original order within each branch.
+    """
+
+    def __init__(self, df, key="branch_name"):
+        self.key = key
+        # Frames from the cache already come grouped by branch; sorting would copy them
+        self.frame = df if df[key].is_monotonic_increasing else df.sort_values(key, kind="stable")
+        self._empty = self.frame.iloc[0:0]
+        self._ranges = {}
+
+        codes, names = pd.factorize(self.frame[key])
+        if len(codes):
+            bounds = np.flatnonzero(np.diff(codes)) + 1
+            starts = np.r_[0, bounds]
+            stops = np.r_[bounds, len(codes)]
+            for start, stop in zip(starts, stops):
+                code = codes[start]
+                if code >= 0:  # -1 marks rows without a branch name
+                    self._ranges[names[code]] = (int(start), int(stop))
+
+    def __getitem__(self, branch):
+        bounds = self._ranges.get(branch)
+        if bounds is None:
+            return self._empty
+        return self.frame.iloc[bounds[0]:bounds[1]]
+
+    def __contains__(self, branch):
+        return branch in self._ranges
+
+    def __len__(self):
+        return len(self._ranges)
+
+    def branches(self):
+        return list(self._ranges)
+
+
+def branch_records(df, key="branch_name"):
+    """One plain-dict record per branch, for sources that hold a single row per branch."""
+    rows = df[df[key].notna()].drop_duplicates(key, keep="first")
+    return {record[key]: record for record in rows.to_dict("records")}
+
+
+class DataStore:
+    """The current version of the data, replaced in the background when the source CSVs change.
+
+    build() turns the loaded frames into everything the app reads (partitions, records,
+    rollups). A new version is loaded and built in full before it replaces the current
+    one, so readers always see one consistent version, and each change is loaded once per
+    process no matter how many sessions are open.
+
+    Reloads reuse every frame whose files haven't changed, and when a source has only
+    gained deltas, just those are parsed and appended. build(frames, previous, appended)
+    gets the previous version and the newly appended rows by frame name, so it can reuse
+    or update what it built before instead of starting over.
+    """
+
+    def __init__(self, build, data_dir=DATA_DIR):
+        self.build = build
+        self.data_dir = Path(data_dir)
+        self._listeners = []
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+        self.current = self._load()
+
+    def _load(self, previous=None):
+        for _ in range(3):
+            version = data_version(self.data_dir)
+            sources = {name: source_state(name, self.data_dir) for name in DATA_FILES}
+            frames, appended = {}, {}
+            for name, state in sources.items():
+                old = previous.sources[name] if previous is not None else None
+                if state == old:
+                    frames[name] = getattr(previous, name)
+                elif old is not None and state[:len(old)] == old:
+                    # Same CSV, new deltas: parse only the new ones
+                    new = [read_source(name, self.data_dir, path)
+                           for path in delta_paths(name, self.data_dir)[len(old) - 1:]]
+                    appended[name] = concat_rows(new)
+                    frames[name] = append_rows(getattr(previous, name), new)
+                else:
+                    frames[name] = load_frame(name, self.data_dir)
+            # If a file changed mid-load, load again so the version matches the frames
+            if data_version(self.data_dir) == version:
+                break
+        data = self.build(frames, previous, appended)
+        data.version = version
+        data.sources = sources
+        return data
+
+    def on_change(self, fn):
+        """Call fn(old, new) after a new version has been swapped in."""
+        self._listeners.append(fn)
+        return fn
+
+    def reload_if_changed(self):
+        with self._reload_lock:
+            if data_version(self.data_dir) == self.current.version:
+                return False
+            new = self._load(self.current)
+            old, self.current = self.current, new
+        for fn in self._listeners:
+            fn(old, new)
+        return True
+
+    def watch(self, interval):
+        """Check the data directory every interval seconds from a background thread."""
+        if self._watcher is not None:
+            return
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.reload_if_changed()
+                except Exception:
+                    # Most likely a CSV caught mid-copy; the next check picks it up
+                    traceback.print_exc()
+
+        self._watcher = threading.Thread(target=loop, name="cpl-data-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+if __name__ == "__main__":
+    # Build step: python datastore.py [data_dir]; add --memory to compare dtype footprints
+    args = [arg for arg in sys.argv[1:] if arg != "--memory"]
+    data_dir = args[0] if args else DATA_DIR
+    if "--memory" in sys.argv[1:]:
+        print(memory_report(data_dir).to_string(index=False, float_format="{:.2f}".format))
+    else:
+        build_cache(data_dir)
@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+
+# Most points a single trace sends to the browser
+MAX_POINTS = int(os.environ.get("CPL_MAX_POINTS", "2000"))
+
+
+def lttb_indices(x, y, n):
+    """Positions of the points kept by Largest-Triangle-Three-Buckets reduction to n points.
+
+    The first and last points are always kept; every bucket in between keeps the point
+    that forms the largest triangle with the previously kept point and the average of
+    the next bucket, which preserves peaks and dips in the series.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size)
+
+    edges = np.linspace(1, size - 1, n - 1).astype(int)
+    keep = [0]
+    a = 0
+    for i in range(n - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else size
+        avg_x = x[stop:next_stop].mean()
+        avg_y = y[stop:next_stop].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:stop] - y[a])
+            - (x[a] - x[start:stop]) * (avg_y - y[a])
+        )
+        a = start + int(area.argmax())
+        keep.append(a)
+    keep.append(size - 1)
+    return np.asarray(keep)
+
+
+def density_bins(df, x, y, budget, label):
+    """Collapse scatter points into (x, y) buckets with an event count, within budget points.
+
+    Identical points are merged first; if that is still over budget, y is binned into
+    steps that double until it fits, and as a last resort only the busiest buckets are
+    kept. Each bucket keeps one example label for its hover text.
+    """
+    step = 1
+    ymax = df[y].max()
+    while True:
+        binned = df.assign(**{y: (df[y] // step) * step})
+        buckets = (
+            binned.groupby([x, y], observed=True, as_index=False)
+                  .agg(events=(y, "size"), example=(label, "first"))
+        )
+        if len(buckets) <= budget or step >= ymax:
+            break
+        step *= 2
+
+    if len(buckets) > budget:
+        buckets = buckets.nlargest(budget, "events")
+    return buckets.sort_values([x, y]), step
@@ -0,0 +1,159 @@
+"""Export every branch's report as static files, without a Shiny server.
+
+    python export_reports.py reports/ [--workers 8] [--branch "Austin"]
+
+Each branch gets <out>/<branch>/report.json (figure JSON, table rows and demographics)
+and <out>/<branch>/index.html, which renders the same figures with a shared copy of
+plotly.js. <out>/index.html links to every branch.
+"""
+import argparse
+import html
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+import plotly.io as pio
+from plotly.offline import get_plotlyjs
+
+# A one-off export doesn't need to watch the data directory
+os.environ.setdefault("CPL_WATCH_DATA", "0")
+
+import app  # noqa: E402
+
+LABELS = {
+    "median_income_display": "Median income",
+    "uninsured_display": "Residents without health insurance",
+    "unemployment_display": "Unemployment rate",
+    "food_display": "Residents who are food insecure",
+    "stations": "Total stations",
+    "sessions": "Total sessions",
+    "average_session_length": "Average session length",
+    "top_genres_table": "Top genres checked out since 2023",
+    "top_reading_level_table": "Checkouts by reading level since 2023",
+    "top_books_table": "Top books checked out since 2023",
+    "top_dvds_table": "Top DVDs checked out since 2023",
+}
+
+# The dashboard pages through thousands of titles; a static report keeps the top ones
+TABLE_ROWS = 50
+
+
+def branch_slug(branch):
+    # Same naming as the branch map files
+    return branch.replace(" ", "_").replace("/", "-")
+
+
+def _plain(record):
+    # Census records hold numpy scalars and NaN; JSON wants plain values and null
+    if record is None:
+        return None
+    return {key: (None if pd.isna(value) else value.item() if hasattr(value, "item") else value)
+            for key, value in record.items()}
+
+
+def branch_report(branch):
+    """Everything the dashboard shows for one branch, built with the app's own builders."""
+    data = app.store.current
+    census = data.census_records.get(branch)
+    computer_use = data.comp_use_records.get(branch)
+
+    values = {output_id: app.format_value(census, *spec) for output_id, spec in app.CENSUS_DISPLAYS.items()}
+    values.update(
+        {output_id: app.format_value(computer_use, *spec) for output_id, spec in app.COMPUTER_USE_DISPLAYS.items()}
+    )
+
+    return {
+        "branch": branch,
+        "data_version": data.version,
+        "values": values,
+        "census": _plain(census),
+        "computer_use": _plain(computer_use),
+        "tables": {
+            output_id: json.loads(data.circulation[source][branch].head(TABLE_ROWS).to_json(orient="records"))
+            for output_id, source in app.BRANCH_TABLES.items()
+        },
+        "figures": {
+            output_id: json.loads(app.cached_figure(output_id, branch, data).to_json())
+            for output_id in app.FIGURE_BUILDERS
+        },
+    }
+
+
+def report_html(report):
+    parts = [
+        "<!DOCTYPE html>",
+        "<html><head><meta charset='utf-8'>",
+        f"<title>CPL Branch Report: {html.escape(report['branch'])}</title>",
+        "<script src='../plotly.min.js'></script>",
+        "<style>body{font-family:sans-serif;margin:2em} table{border-collapse:collapse}"
+        " td,th{padding:2px 8px;border-bottom:1px solid #ddd} .fig{max-width:900px}</style>",
+        "</head><body>",
+        f"<h1>{html.escape(report['branch'])}</h1>",
+        "<dl>",
+    ]
+    for output_id, value in report["values"].items():
+        parts.append(f"<dt>{html.escape(LABELS[output_id])}</dt><dd>{html.escape(value)}</dd>")
+    parts.append("</dl>")
+
+    for output_id, fig_json in report["figures"].items():
+        fig = pio.from_json(json.dumps(fig_json))
+        parts.append("<div class='fig'>" + pio.to_html(fig, full_html=False, include_plotlyjs=False) + "</div>")
+
+    for output_id, rows in report["tables"].items():
+        parts.append(f"<h3>{html.escape(LABELS[output_id])}</h3>")
+        parts.append(pd.DataFrame(rows).to_html(index=False, na_rep=""))
+
+    parts.append("</body></html>")
+    return "\n".join(parts)
+
+
+def export_branch(branch, out_dir):
+    report = branch_report(branch)
+    branch_dir = Path(out_dir) / branch_slug(branch)
+    branch_dir.mkdir(parents=True, exist_ok=True)
+    (branch_dir / "report.json").write_text(json.dumps(report))
+    (branch_dir / "index.html").write_text(report_html(report), encoding="utf-8")
+    return branch
+
+
+def export_all(out_dir, branches=None, workers=None):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    (out_dir / "plotly.min.js").write_text(get_plotlyjs(), encoding="utf-8")
+
+    if branches is None:
+        branches = app.store.current.branches
+    workers = workers or os.cpu_count() or 1
+
+    if workers > 1:
+        # app is already imported, so forked workers start with the data loaded
+        with ProcessPoolExecutor(workers) as pool:
+            list(pool.map(export_branch, branches, [out_dir] * len(branches)))
+    else:
+        for branch in branches:
+            export_branch(branch, out_dir)
+
+    links = "\n".join(
+        f"<li><a href='{branch_slug(b)}/index.html'>{html.escape(b)}</a></li>" for b in branches
+    )
+    (out_dir / "index.html").write_text(
+        f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>CPL Branch Reports</title></head>"
+        f"<body><h1>CPL Branch Reports</h1><ul>\n{links}\n</ul></body></html>",
+        encoding="utf-8",
+    )
+    return branches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export static CPL branch reports")
+    parser.add_argument("out_dir")
+    parser.add_argument("--workers", type=int, default=None, help="processes to use (default: one per core)")
+    parser.add_argument("--branch", action="append", help="only export this branch (repeatable)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    exported = export_all(args.out_dir, args.branch, args.workers)
+    print(f"Exported {len(exported)} branch reports to {args.out_dir} in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,141 @@
+import os
+import threading
+from collections import OrderedDict
+
+import plotly.io as pio
+
+DEFAULT_MAX_BYTES = int(float(os.environ.get("CPL_FIGURE_CACHE_MB", "64")) * 1024 * 1024)
+
+
+class FigureCache:
+    """Process-wide LRU cache of serialized Plotly figures, shared by every session.
+
+    Entries are figure JSON keyed by (output id, branch, data version). The cache is
+    bounded by the total size of the stored JSON; the least recently used figures are
+    dropped first.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get_json(self, key):
+        with self._lock:
+            fig_json = self._items.get(key)
+            if fig_json is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return fig_json
+
+    def put_json(self, key, fig_json):
+        size = len(fig_json)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[key] = fig_json
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def get_or_build(self, key, build):
+        """Return the cached figure for key, building and storing it on a miss."""
+        fig_json = self.get_json(key)
+        if fig_json is None:
+            # Build outside the lock; two sessions missing at once just build twice
+            fig_json = build().to_json()
+            self.put_json(key, fig_json)
+        return pio.from_json(fig_json)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+DEFAULT_MAX_VIEWS = int(os.environ.get("CPL_VIEW_CACHE", "64"))
+
+
+class ViewCache:
+    """Process-wide LRU cache of branch views for a date range, shared by every session.
+
+    Entries are the views themselves, keyed by (data version, branch, start, end), so
+    sessions looking at the same branch and months share one build. The cache holds at
+    most max_entries views; the least recently used are dropped first.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_VIEWS):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build):
+        """Return the cached view for key, building and storing it on a miss."""
+        with self._lock:
+            view = self._items.get(key)
+            if view is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return view
+            self.misses += 1
+        # Built outside the lock, like figures
+        view = build()
+        if self.max_entries > 0:
+            with self._lock:
+                self._items[key] = view
+                self._items.move_to_end(key)
+                while len(self._items) > self.max_entries:
+                    self._items.popitem(last=False)
+        return view
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._items),
+                "max_entries": self.max_entries,
+            }
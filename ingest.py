@@ -0,0 +1,135 @@
+"""Add new months of data without replacing the source CSVs.
+
+    python ingest.py visits_data_all visits_2025_01.csv
+    python ingest.py branch_titles_filtered.csv titles_2025_01.csv --data-dir cplbranches/data
+    python ingest.py --compact
+
+A delta must have the same columns as its source, parse under the source's schema, name
+only branches in the crosswalk, and hold only months not already stored for its branches.
+Accepted deltas are kept under <data dir>/deltas/<source>/ and appended whenever the data
+is loaded; running workers pick them up on their next check and parse just the new file.
+--compact folds the deltas back into the source CSVs, which costs one full reload.
+"""
+import argparse
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+from datastore import (
+    APPENDABLE, DATA_DIR, DATA_FILES, SCHEMAS, apply_schema, delta_dir, delta_paths, load_frame,
+)
+
+
+def source_name(source):
+    # Accept the frame name or the CSV's file name
+    for name, filename in DATA_FILES.items():
+        if source in (name, filename, Path(filename).stem):
+            return name
+    raise ValueError(f"unknown source {source!r}")
+
+
+def validate_delta(name, path, data_dir=DATA_DIR):
+    """Parse a delta CSV for source name, raising ValueError listing everything wrong with it."""
+    if name not in APPENDABLE:
+        raise ValueError(f"{name} can't be appended to; appendable sources: {', '.join(APPENDABLE)}")
+
+    expected = list(pd.read_csv(Path(data_dir) / DATA_FILES[name], nrows=0).columns)
+    raw = pd.read_csv(path, dtype=str)
+    if list(raw.columns) != expected:
+        raise ValueError(f"columns {list(raw.columns)} don't match {DATA_FILES[name]}: {expected}")
+    if raw.empty:
+        raise ValueError("no rows")
+
+    schema = SCHEMAS.get(name, {})
+    delta = apply_schema(raw.copy(), schema)
+    problems = []
+    for col, kind in schema.items():
+        unreadable = delta[col].isna() & raw[col].notna()
+        if kind != "category" and unreadable.any():
+            problems.append(f"{unreadable.sum()} rows with an unreadable {col}, e.g. {raw.loc[unreadable, col].iloc[0]!r}")
+
+    month = APPENDABLE[name]
+    if delta["branch_name"].isna().any() or delta[month].isna().any():
+        problems.append(f"rows without a branch_name or {month}")
+
+    branches = set(load_frame("branch_names", data_dir)["branch_name"].dropna().astype(str))
+    unknown = sorted(set(raw["branch_name"].dropna()) - branches)
+    if unknown:
+        problems.append(f"branches not in the crosswalk: {', '.join(unknown)}")
+
+    # A month can only be added once per branch
+    stored = load_frame(name, data_dir)
+    stored_months = pd.MultiIndex.from_arrays([stored["branch_name"].astype(str), stored[month]])
+    delta_months = pd.MultiIndex.from_arrays([delta["branch_name"].astype(str), delta[month]]).unique()
+    repeated = delta_months[delta_months.isin(stored_months)]
+    if len(repeated):
+        branch, when = repeated[0]
+        problems.append(f"{len(repeated)} branch months already stored, e.g. {branch} {when:%Y-%m}")
+
+    if problems:
+        raise ValueError("; ".join(problems))
+    return delta
+
+
+def add_delta(name, path, data_dir=DATA_DIR):
+    """Validate a delta and store it after the source's existing deltas."""
+    delta = validate_delta(name, path, data_dir)
+    target_dir = delta_dir(name, data_dir)
+    target_dir.mkdir(parents=True, exist_ok=True)
+    target = target_dir / f"{len(delta_paths(name, data_dir)) + 1:05d}-{Path(path).name}"
+
+    # Copy under a name the loader ignores, then rename, so a watcher never reads half a file
+    tmp = target.with_suffix(".tmp")
+    shutil.copyfile(path, tmp)
+    os.replace(tmp, target)
+    return target, delta
+
+
+def compact(data_dir=DATA_DIR):
+    """Append every source's deltas to its CSV and remove them."""
+    compacted = {}
+    for name in APPENDABLE:
+        deltas = delta_paths(name, data_dir)
+        if not deltas:
+            continue
+        source = Path(data_dir) / DATA_FILES[name]
+        tmp = source.with_suffix(f".{os.getpid()}.tmp")
+        chunks = [source.read_bytes()]
+        for path in deltas:
+            chunks.append(path.read_bytes().split(b"\n", 1)[1])  # without the header
+        with open(tmp, "wb") as out:
+            for chunk in chunks:
+                if chunk:
+                    out.write(chunk if chunk.endswith(b"\n") else chunk + b"\n")
+        os.replace(tmp, source)
+        for path in deltas:
+            path.unlink()
+        compacted[name] = len(deltas)
+    return compacted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Append a month of data to a CPL source")
+    parser.add_argument("source", nargs="?", help=f"one of: {', '.join(APPENDABLE)}")
+    parser.add_argument("delta", nargs="?", help="CSV with the new rows")
+    parser.add_argument("--compact", action="store_true", help="fold stored deltas into the source CSVs")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    args = parser.parse_args()
+
+    if args.compact:
+        for name, count in compact(args.data_dir).items():
+            print(f"{DATA_FILES[name]}: folded in {count} deltas")
+        sys.exit(0)
+    if not (args.source and args.delta):
+        parser.error("source and delta are required unless --compact is given")
+
+    try:
+        target, delta = add_delta(source_name(args.source), args.delta, args.data_dir)
+    except ValueError as e:
+        sys.exit(f"Rejected {args.delta}: {e}")
+    month = delta[APPENDABLE[source_name(args.source)]]
+    print(f"Added {len(delta):,} rows for {delta['branch_name'].nunique()} branches "
+          f"({month.min():%Y-%m} to {month.max():%Y-%m}) as {target}")
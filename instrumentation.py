@@ -0,0 +1,161 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+# Opt-in: with CPL_INSTRUMENT unset, timed() hands functions back untouched
+ENABLED = os.environ.get("CPL_INSTRUMENT", "") not in ("", "0")
+
+# Recent calls kept per output for the latency quantiles
+RECENT_CALLS = 500
+
+
+def output_rows(value):
+    """Rough count of the rows behind an output value: table rows or plotted points."""
+    data = getattr(value, "data", None)
+    if isinstance(value, pd.DataFrame):
+        return len(value)
+    if isinstance(data, pd.DataFrame):
+        return len(data)
+    if isinstance(data, tuple):  # Plotly figure traces
+        return sum(_trace_points(trace) for trace in data)
+    return 0 if value is None else 1
+
+
+def _trace_points(trace):
+    for attr in ("x", "values"):
+        points = getattr(trace, attr, None)
+        if points is not None:
+            return len(points)
+    return 0
+
+
+def output_size(value):
+    """Size in bytes of an output value once serialized for the browser."""
+    if value is None:
+        return 0
+    if hasattr(value, "to_json") and not isinstance(value, pd.DataFrame):
+        return len(value.to_json())
+    data = getattr(value, "data", value)
+    if isinstance(data, pd.DataFrame):
+        return len(data.to_json(orient="split"))
+    if isinstance(value, dict):
+        return len(json.dumps(value, default=str))
+    return len(str(value))
+
+
+class Metrics:
+    """Per-output call counts, wall time, rows and serialized bytes, shared by all sessions."""
+
+    def __init__(self, recent=RECENT_CALLS):
+        self.recent = recent
+        self._outputs = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, rows, size):
+        with self._lock:
+            stats = self._outputs.get(name)
+            if stats is None:
+                stats = self._outputs[name] = {
+                    "calls": 0, "seconds": 0.0, "rows": 0, "bytes": 0,
+                    "last_rows": 0, "last_bytes": 0, "recent": deque(maxlen=self.recent),
+                }
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            stats["rows"] += rows
+            stats["bytes"] += size
+            stats["last_rows"] = rows
+            stats["last_bytes"] = size
+            stats["recent"].append(seconds)
+
+    def _snapshot(self):
+        with self._lock:
+            return {name: dict(stats, recent=list(stats["recent"])) for name, stats in self._outputs.items()}
+
+    def summary(self):
+        rows = []
+        for name, stats in sorted(self._snapshot().items()):
+            recent = np.array(stats["recent"]) * 1000
+            rows.append({
+                "Output": name,
+                "Calls": stats["calls"],
+                "Mean ms": round(stats["seconds"] / stats["calls"] * 1000, 1),
+                "p50 ms": round(float(np.percentile(recent, 50)), 1),
+                "p95 ms": round(float(np.percentile(recent, 95)), 1),
+                "Max ms": round(float(recent.max()), 1),
+                "Last rows": stats["last_rows"],
+                "Last KB": round(stats["last_bytes"] / 1024, 1),
+            })
+        return pd.DataFrame(rows, columns=["Output", "Calls", "Mean ms", "p50 ms", "p95 ms", "Max ms", "Last rows", "Last KB"])
+
+    def prometheus(self, gauges=None):
+        """Metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP cpl_output_seconds Wall time of render functions and reactive calcs.",
+            "# TYPE cpl_output_seconds summary",
+        ]
+        snapshot = self._snapshot()
+        for name, stats in sorted(snapshot.items()):
+            for q in (0.5, 0.95):
+                lines.append(f'cpl_output_seconds{{output="{name}",quantile="{q}"}} {np.quantile(stats["recent"], q):.6f}')
+            lines.append(f'cpl_output_seconds_sum{{output="{name}"}} {stats["seconds"]:.6f}')
+            lines.append(f'cpl_output_seconds_count{{output="{name}"}} {stats["calls"]}')
+        for metric, key, help_text in (
+            ("cpl_output_rows_total", "rows", "Rows or plotted points produced."),
+            ("cpl_output_bytes_total", "bytes", "Serialized size of produced values."),
+        ):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for name, stats in sorted(snapshot.items()):
+                lines.append(f'{metric}{{output="{name}"}} {stats[key]}')
+        for metric, value in (gauges or {}).items():
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def timed_call(name, fn, *args):
+    """fn(*args), recorded in metrics under name when enabled. For work an output hands off
+    to another thread, where the output's own wrapper can't see it."""
+    if not ENABLED:
+        return fn(*args)
+    start = time.perf_counter()
+    value = fn(*args)
+    elapsed = time.perf_counter() - start
+    metrics.record(name, elapsed, output_rows(value), output_size(value))
+    return value
+
+
+def timed(fn):
+    """Record every call of a render function or reactive calc in metrics, when enabled."""
+    if not ENABLED:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper():
+        return timed_call(fn.__name__, fn)
+
+    return wrapper
+
+
+def with_metrics_route(shiny_app, gauges=None):
+    """Serve shiny_app alongside a /metrics endpoint for Prometheus to scrape."""
+    from starlette.applications import Starlette
+    from starlette.responses import PlainTextResponse
+    from starlette.routing import Mount, Route
+
+    async def metrics_endpoint(request):
+        return PlainTextResponse(
+            metrics.prometheus(gauges() if gauges else None),
+            media_type="text/plain; version=0.0.4",
+        )
+
+    return Starlette(routes=[Route("/metrics", metrics_endpoint), Mount("/", app=shiny_app)])
@@ -0,0 +1,476 @@
+"""Load-test the dashboard with simulated concurrent sessions.
+
+    python loadtest.py --data-dir cplbranches/data                # 10 sessions for 60s
+    python loadtest.py --sessions 50 --duration 120 --workers 2 --json load.json
+    python loadtest.py --scale 10 --sessions 25                   # bench.py's synthetic data
+    python loadtest.py --url http://127.0.0.1:8000 --sessions 20  # an already running server
+
+Launches the app under uvicorn on a free local port, then opens N websocket sessions that
+behave like a branch manager in a browser: read the page, open it on some branch, move
+between the tabs and switch branch every so often, pausing between actions. Every output
+update the server sends is timed from the action that triggered it. Reported: per-output
+update latency percentiles, time until a whole action has settled, actions and updates per
+second, and the CPU and memory of the server processes (needs psutil).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from html.parser import HTMLParser
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# What a simulated user does next, with relative weights
+ACTIONS = {"switch branch": 5, "switch tab": 4, "pick months": 1}
+
+# Elements Shiny binds as outputs, by class (data frames are their own element)
+OUTPUT_CLASSES = {
+    "shiny-html-output", "shiny-text-output", "shiny-image-output", "shiny-plot-output", "shiny-ipywidget-output",
+}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+
+class PageLayout(HTMLParser):
+    """Inputs, tabs and outputs of the served page, as a browser would bind them.
+
+    inputs maps input id -> initial value, choices holds every select's options, outputs
+    maps output id -> the tab it sits on (None when always visible), tabs maps the
+    navset's input id -> its tab names, and date_ranges maps date range inputs -> (min, max).
+    """
+
+    def __init__(self, html):
+        super().__init__()
+        self.inputs, self.choices, self.outputs, self.tabs, self.date_ranges = {}, {}, {}, {}, {}
+        self._open = []  # (tag, tab) of the enclosing elements
+        self._select = self._navset = self._date_range = None
+        self.feed(html)
+
+    def _tab(self):
+        return self._open[-1][1] if self._open else None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = set((attrs.get("class") or "").split())
+        tab = attrs.get("data-value") if "tab-pane" in classes else self._tab()
+        element_id = attrs.get("id")
+
+        if element_id and (classes & OUTPUT_CLASSES or tag == "shiny-data-frame"):
+            self.outputs[element_id] = tab
+        if tag == "ul" and "shiny-tab-input" in classes:
+            self._navset = element_id
+            self.tabs[element_id] = []
+        elif tag == "a" and self._navset and attrs.get("data-bs-toggle") == "tab":
+            self.tabs[self._navset].append(attrs["data-value"])
+            if "active" in classes:
+                self.inputs[self._navset] = attrs["data-value"]
+        elif tag == "div" and "shiny-date-range-input" in classes:
+            # Sent as "<id>:shiny.date" with the initial dates of its two text boxes
+            self._date_range = f"{element_id}:shiny.date"
+            self.inputs[self._date_range] = []
+        elif tag == "input" and self._date_range and "data-initial-date" in attrs:
+            self.inputs[self._date_range].append(attrs["data-initial-date"])
+            self.date_ranges[self._date_range] = (attrs.get("data-min-date"), attrs.get("data-max-date"))
+            if len(self.inputs[self._date_range]) == 2:
+                self._date_range = None
+        elif tag == "input" and element_id:
+            if attrs.get("type") == "checkbox":
+                self.inputs[element_id] = "checked" in attrs
+            elif attrs.get("type") == "number":
+                self.inputs[element_id] = float(attrs["value"]) if attrs.get("value") else None
+            else:
+                self.inputs[element_id] = attrs.get("value") or ""
+        elif tag == "select" and element_id:
+            self._select = element_id
+            self.choices[element_id] = []
+            self.inputs[element_id] = [] if "multiple" in attrs else None
+        elif tag == "option" and self._select:
+            self.choices[self._select].append(attrs.get("value"))
+            if "selected" in attrs:
+                if isinstance(self.inputs[self._select], list):
+                    self.inputs[self._select].append(attrs.get("value"))
+                else:
+                    self.inputs[self._select] = attrs.get("value")
+
+        if tag not in VOID_TAGS:
+            self._open.append((tag, tab))
+
+    def handle_endtag(self, tag):
+        if tag == "select" and self._select:
+            # A single select with nothing marked selected shows its first option
+            if self.inputs[self._select] is None and self.choices[self._select]:
+                self.inputs[self._select] = self.choices[self._select][0]
+            self._select = None
+        elif tag == "ul":
+            self._navset = None
+        for i in range(len(self._open) - 1, -1, -1):
+            if self._open[i][0] == tag:
+                del self._open[i:]
+                break
+
+    def hidden(self, tab):
+        """Shiny's visibility flags for every output with tab open."""
+        return {
+            f".clientdata_output_{output_id}_hidden": output_tab is not None and output_tab != tab
+            for output_id, output_tab in self.outputs.items()
+        }
+
+
+class Recorder:
+    """Latency samples, payload sizes and errors from every session."""
+
+    def __init__(self):
+        self.updates = {}   # output id -> [(seconds since the triggering action, bytes)]
+        self.actions = {}   # action -> [seconds until every output it touched had updated]
+        self.timeouts = {}
+        self.errors = {}
+        self.custom = {}    # custom message type -> [bytes], e.g. the widget payloads behind plotly outputs
+        self.received_bytes = 0
+
+    def update(self, output_id, latency, size):
+        self.updates.setdefault(output_id, []).append((latency, size))
+
+    def action(self, name, settled):
+        self.actions.setdefault(name, []).append(settled)
+
+    def custom_message(self, kind, size):
+        self.custom.setdefault(kind, []).append(size)
+
+    def timeout(self, name):
+        self.timeouts[name] = self.timeouts.get(name, 0) + 1
+
+    def error(self, output_id, message):
+        self.errors.setdefault(output_id, []).append(message)
+
+
+class SimulatedSession:
+    """One browser tab driving the app over its websocket.
+
+    Like a user waiting for the page, each session sends its next action only once the
+    last one has settled: the server is idle and every output it started recalculating,
+    including figures still building in the background, has been sent.
+    """
+
+    def __init__(self, url, layout, recorder, rng, think, timeout):
+        self.url, self.layout, self.recorder, self.rng = url, layout, recorder, rng
+        self.think, self.timeout = think, timeout
+        self.branches = layout.choices["branch"]
+        self.navset = next(iter(layout.tabs))
+        self._pending = set()
+        self._settled = asyncio.Event()
+        self._busy = self._busy_seen = False
+        self._action = self._sent = None
+
+    def _start(self, name):
+        self._action, self._sent = name, time.perf_counter()
+        self._pending.clear()
+        self._settled.clear()
+        self._busy_seen = False
+
+    async def _receive(self, ws):
+        async for raw in ws:
+            now = time.perf_counter()
+            self.recorder.received_bytes += len(raw)
+            message = json.loads(raw)
+            for kind in message.get("custom", {}):
+                self.recorder.custom_message(kind, len(raw))
+            if "busy" in message:
+                self._busy = message["busy"] == "busy"
+                self._busy_seen = self._busy_seen or self._busy
+            if "recalculating" in message:
+                status = message["recalculating"]
+                if status["status"] == "recalculating":
+                    self._pending.add(status["name"])
+                else:
+                    self._pending.discard(status["name"])
+            progress = message.get("progress", {})
+            if progress.get("type") == "binding" and progress["message"].get("persistent"):
+                # Still computing in the background (an extended task); done when its value arrives
+                self._pending.add(progress["message"]["id"])
+            for output_id, value in message.get("values", {}).items():
+                self._pending.discard(output_id)
+                self.recorder.update(output_id, now - self._sent, len(json.dumps(value)))
+            for output_id, error in message.get("errors", {}).items():
+                self._pending.discard(output_id)
+                self.recorder.error(output_id, error.get("message", str(error)))
+            if "values" in message and self._busy_seen and not self._busy and not self._pending:
+                if not self._settled.is_set():
+                    self.recorder.action(self._action, now - self._sent)
+                    self._settled.set()
+
+    def _next_action(self, inputs):
+        action = self.rng.choices(list(ACTIONS), weights=list(ACTIONS.values()))[0]
+        if action == "switch branch":
+            branch = self.rng.choice([b for b in self.branches if b != inputs["branch"]] or self.branches)
+            return action, {"branch": branch}
+        if action == "pick months" and self.layout.date_ranges:
+            # A run of whole months somewhere inside the data
+            input_id, (first, last) = self.rng.choice(list(self.layout.date_ranges.items()))
+            months = pd.period_range(first, last, freq="M")
+            start, end = sorted(self.rng.sample(range(len(months)), 2)) if len(months) > 1 else (0, 0)
+            return action, {input_id: [str(months[start].start_time.date()), str(months[end].end_time.date())]}
+        tabs = self.layout.tabs[self.navset]
+        tab = self.rng.choice([t for t in tabs if t != inputs[self.navset]] or tabs)
+        return action, {self.navset: tab, **self.layout.hidden(tab)}
+
+    async def _settle(self):
+        try:
+            await asyncio.wait_for(self._settled.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            self.recorder.timeout(self._action)
+
+    async def run(self, until):
+        import websockets
+
+        inputs = dict(self.layout.inputs, branch=self.rng.choice(self.branches))
+        async with websockets.connect(self.url, max_size=None) as ws:
+            receiver = asyncio.create_task(self._receive(ws))
+            try:
+                self._start("open page")
+                await ws.send(json.dumps({"method": "init", "data": {**inputs, **self.layout.hidden(inputs[self.navset])}}))
+                await self._settle()
+                while True:
+                    pause = self.rng.expovariate(1 / self.think)
+                    if time.perf_counter() + pause >= until:
+                        break
+                    await asyncio.sleep(pause)
+                    name, update = self._next_action(inputs)
+                    inputs.update(update)
+                    self._start(name)
+                    await ws.send(json.dumps({"method": "update", "data": update}))
+                    await self._settle()
+            finally:
+                receiver.cancel()
+
+
+class WorkerMonitor:
+    """Samples CPU time and RSS of the server process and its workers in a background thread."""
+
+    def __init__(self, pid, interval=0.5):
+        import psutil
+
+        self._root = psutil.Process(pid)
+        self._interval = interval
+        self._stop = threading.Event()
+        self.rss = []
+        self._cpu_start, self._wall_start = self._cpu(), time.perf_counter()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def _processes(self):
+        return [self._root, *self._root.children(recursive=True)]
+
+    def _cpu(self):
+        total = 0.0
+        for proc in self._processes():
+            try:
+                times = proc.cpu_times()
+                total += times.user + times.system
+            except Exception:
+                pass
+        return total
+
+    def _sample(self):
+        while not self._stop.wait(self._interval):
+            rss = 0
+            for proc in self._processes():
+                try:
+                    rss += proc.memory_info().rss
+                except Exception:
+                    pass
+            self.rss.append(rss)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        wall = time.perf_counter() - self._wall_start
+        rss = self.rss or [0]
+        return {
+            "workers": len(self._processes()),
+            "cpu_percent": (self._cpu() - self._cpu_start) / wall * 100,
+            "rss_mean_mb": float(np.mean(rss)) / 2**20,
+            "rss_peak_mb": max(rss) / 2**20,
+        }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def launch_server(port, workers=1, data_dir=None, timeout=300):
+    """Start the app under uvicorn and wait until it serves the page."""
+    env = dict(os.environ, CPL_WATCH_DATA="0")
+    if data_dir:
+        env["CPL_DATA_DIR"] = str(Path(data_dir).resolve())
+    log = tempfile.TemporaryFile()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=Path(__file__).resolve().parent, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            log.seek(0)
+            sys.exit(f"Server exited with code {server.returncode}:\n{log.read().decode(errors='replace')[-3000:]}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5).read()
+            return server
+        except OSError:
+            time.sleep(0.5)
+    server.kill()
+    sys.exit(f"Server didn't answer within {timeout}s")
+
+
+def _percentiles(samples):
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"p50_ms": p50 * 1000, "p95_ms": p95 * 1000, "p99_ms": p99 * 1000, "max_ms": max(samples) * 1000}
+
+
+async def run_sessions(url, layout, sessions, duration, think, ramp, seed, timeout):
+    recorder = Recorder()
+    until = time.perf_counter() + ramp + duration
+
+    async def start(i):
+        # Sessions arrive spread over the ramp-up instead of all at once
+        await asyncio.sleep(ramp * i / max(sessions, 1))
+        session = SimulatedSession(url, layout, recorder, random.Random(seed + i), think, timeout)
+        try:
+            await session.run(until)
+        except Exception as e:
+            recorder.error("session", f"{type(e).__name__}: {e}")
+
+    await asyncio.gather(*(start(i) for i in range(sessions)))
+    return recorder
+
+
+def summarize(recorder, elapsed, sessions, worker=None):
+    actions = sum(len(samples) for samples in recorder.actions.values())
+    updates = sum(len(samples) for samples in recorder.updates.values())
+    return {
+        "sessions": sessions,
+        "elapsed_s": elapsed,
+        "actions_per_s": actions / elapsed,
+        "updates_per_s": updates / elapsed,
+        "received_kb_per_s": recorder.received_bytes / 1024 / elapsed,
+        "actions": {
+            name: {"count": len(samples), **_percentiles(samples)} for name, samples in recorder.actions.items()
+        },
+        "custom_messages": {
+            kind: {"count": len(sizes), "kb_mean": float(np.mean(sizes)) / 1024} for kind, sizes in recorder.custom.items()
+        },
+        "timeouts": recorder.timeouts,
+        "outputs": {
+            output_id: {
+                "updates": len(samples),
+                **_percentiles([latency for latency, _ in samples]),
+                "kb_mean": float(np.mean([size for _, size in samples])) / 1024,
+            }
+            for output_id, samples in recorder.updates.items()
+        },
+        "errors": {output_id: len(messages) for output_id, messages in recorder.errors.items()},
+        "worker": worker,
+    }
+
+
+def print_report(result):
+    print(f"\n== {result['sessions']} sessions over {result['elapsed_s']:.0f}s: "
+          f"{result['actions_per_s']:.1f} actions/s, {result['updates_per_s']:.1f} output updates/s, "
+          f"{result['received_kb_per_s']:.0f} KB/s received")
+    if result["worker"]:
+        worker = result["worker"]
+        print(f"server ({worker['workers']} processes): CPU {worker['cpu_percent']:.0f}%, "
+              f"RSS mean {worker['rss_mean_mb']:.0f} MB, peak {worker['rss_peak_mb']:.0f} MB")
+    else:
+        print("server CPU/RSS: not measured (needs psutil and a locally launched server)")
+
+    header = f"{'':<28}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    print(f"\n{'action (until settled)':<28}" + header[28:])
+    print("-" * len(header))
+    for name, row in sorted(result["actions"].items()):
+        print(f"{name:<28}{row['count']:>8}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+              f"{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}")
+
+    print(f"\n{'output':<28}{'updates':>8}" + header[36:] + f"{'KB mean':>10}")
+    print("-" * (len(header) + 10))
+    for output_id, row in sorted(result["outputs"].items()):
+        print(f"{output_id:<28}{row['updates']:>8}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+              f"{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}{row['kb_mean']:>10.1f}")
+
+    if result["custom_messages"]:
+        print("\ncustom messages: " + ", ".join(
+            f"{kind} x{row['count']} ({row['kb_mean']:.0f} KB mean)" for kind, row in sorted(result["custom_messages"].items())
+        ))
+    if result["timeouts"]:
+        print("\nnot settled within the timeout: "
+              + ", ".join(f"{name} x{count}" for name, count in sorted(result["timeouts"].items())))
+    if result["errors"]:
+        print("\nerrors: " + ", ".join(f"{output_id} x{count}" for output_id, count in sorted(result["errors"].items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent sessions against the CPL branch dashboard")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=60, help="seconds of steady load after the ramp-up")
+    parser.add_argument("--ramp", type=float, default=10, help="seconds over which sessions connect")
+    parser.add_argument("--think", type=float, default=3, help="mean pause between a session's actions, in seconds")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for an action to settle")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--data-dir", help="data for the launched server (default: the app's own)")
+    parser.add_argument("--scale", type=int, help="launch against bench.py's synthetic data at this scale")
+    parser.add_argument("--url", help="test this running server instead of launching one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    server = monitor = None
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.url
+        if not url:
+            data_dir = args.data_dir
+            if args.scale:
+                from bench import synthetic_data
+
+                data_dir = Path(tmp) / f"scale{args.scale}"
+                synthetic_data(data_dir, args.scale)
+            port = _free_port()
+            server = launch_server(port, args.workers, data_dir)
+            url = f"http://127.0.0.1:{port}"
+        try:
+            layout = PageLayout(urllib.request.urlopen(url.rstrip("/") + "/").read().decode())
+            if server is not None:
+                try:
+                    monitor = WorkerMonitor(server.pid)
+                except ImportError:
+                    pass
+            ws_url = url.replace("http", "ws", 1).rstrip("/") + "/websocket/"
+            start = time.perf_counter()
+            recorder = asyncio.run(run_sessions(
+                ws_url, layout, args.sessions, args.duration, args.think, args.ramp, args.seed, args.timeout,
+            ))
+            elapsed = time.perf_counter() - start
+            worker = monitor.stop() if monitor else None
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    result = summarize(recorder, elapsed, args.sessions, worker)
+    print_report(result)
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
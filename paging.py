@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+from pandas.api.types import is_string_dtype
+
+from rollups import BranchTables
+
+# Rows sent to the browser per page of a long table
+PAGE_SIZE = int(os.environ.get("CPL_TABLE_PAGE_SIZE", "25"))
+
+
+class SortedTable:
+    """One branch's table with its row order under every column worked out up front.
+
+    A page for any sort and filter is then a mask over a precomputed order plus a slice,
+    so only one page of rows is ever sent, however long the table is.
+    """
+
+    def __init__(self, df):
+        self.frame = df.reset_index(drop=True)
+        self._orders = {
+            (col, descending): self.frame.sort_values(
+                col, ascending=not descending, kind="stable", na_position="last"
+            ).index.to_numpy()
+            for col in self.frame.columns
+            for descending in (False, True)
+        }
+        # Text columns, lower-cased once for the filter box. Titles are Arrow strings in
+        # shared mode, not objects.
+        self._text = [
+            self.frame[col].str.lower() for col in self.frame.columns if is_string_dtype(self.frame[col])
+        ]
+
+    def __len__(self):
+        return len(self.frame)
+
+    def rows(self, sort=None, descending=False, query=""):
+        """Positions of the rows containing query, in sort order (the table's own order by default)."""
+        order = self._orders.get((sort, descending))
+        if order is None:
+            order = np.arange(len(self.frame))
+        if query:
+            query = query.lower()
+            matches = np.zeros(len(self.frame), dtype=bool)
+            for text in self._text:
+                matches |= text.str.contains(query, regex=False, na=False).to_numpy()
+            order = order[matches[order]]
+        return order
+
+    def page(self, number, sort=None, descending=False, query=""):
+        """Rows on page number (from 0, clamped to the last page), with the offset of its
+        first row and the number of matching rows."""
+        order = self.rows(sort, descending, query)
+        last = max(len(order) - 1, 0) // PAGE_SIZE
+        start = min(max(number, 0), last) * PAGE_SIZE
+        return self.frame.iloc[order[start:start + PAGE_SIZE]], start, len(order)
+
+
+def sorted_tables(tables, previous=None, changed=None):
+    """SortedTable for every branch in a BranchTables.
+
+    Given the previous version's sorted tables and the branches whose tables changed since,
+    every other branch keeps its previous SortedTable.
+    """
+    def sorted_table(branch, df):
+        if previous is not None and branch not in changed and branch in previous:
+            return previous[branch]
+        return SortedTable(df)
+
+    return BranchTables({branch: sorted_table(branch, df) for branch, df in tables.items()}, SortedTable(tables.empty))
+
+
+def sort_choices(columns):
+    # Select choices for a table's sort control; "" keeps the table's own (ranked) order
+    choices = {"": "Top first"}
+    for col in columns:
+        choices[f"{col}:asc"] = f"{col} ↑"
+        choices[f"{col}:desc"] = f"{col} ↓"
+    return choices
+
+
+def page_summary(rows, start, total):
+    if not total:
+        return "No matching rows"
+    return f"Rows {start + 1:,}–{start + len(rows):,} of {total:,}"
@@ -0,0 +1,52 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Set in the prewarm pool's own processes. Server workers started by uvicorn or shiny run
+# are multiprocessing children too, so the parent process alone can't tell them apart.
+WORKER_ENV = "CPL_PREWARM_WORKER"
+
+
+def in_prewarm_worker():
+    return os.environ.get(WORKER_ENV) == "1"
+
+
+def _mark_worker():
+    os.environ[WORKER_ENV] = "1"
+
+
+def _figure_json(job):
+    # Runs in a spawned worker, which loads its own copy of the data on first use
+    import app
+
+    output_id, branch = job
+    data = app.store.current
+    return data.version, app.FIGURE_BUILDERS[output_id](data, branch).to_json()
+
+
+def prewarm(builders, cache, data, workers=1):
+    """Build every branch's figures into the figure cache so no session pays the cold cost.
+
+    The Circulation tables are already built when the data loads, so only the figures
+    need warming. With workers > 1 the figures are built in a pool of spawned processes
+    (forking while app.py is still importing would leave the workers waiting on its
+    import lock).
+    """
+    jobs = [
+        (output_id, branch)
+        for branch in data.branches
+        for output_id in builders
+        if (output_id, branch, data.version) not in cache
+    ]
+
+    if workers > 1:
+        with ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn"), initializer=_mark_worker,
+        ) as pool:
+            results = pool.map(_figure_json, jobs, chunksize=len(builders))
+            for (output_id, branch), (version, fig_json) in zip(jobs, results):
+                cache.put_json((output_id, branch, version), fig_json)
+    else:
+        for output_id, branch in jobs:
+            cache.put_json((output_id, branch, data.version), builders[output_id](data, branch).to_json())
+    return len(jobs)
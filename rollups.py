@@ -0,0 +1,262 @@
+import os
+
+import pandas as pd
+
+from datastore import concat_rows
+from downsample import MAX_POINTS, density_bins
+
+TOP_GENRES = 20
+# Titles kept per branch and category; the tables are paged, so this can run to thousands
+TOP_TITLES = int(os.environ.get("CPL_TOP_TITLES", "5000"))
+
+BOOK_MATERIALS = ["BOOKS"]
+DVD_MATERIALS = ["DVDS", "DVD-BLURAY"]
+
+# Order of the bars in the attendance-by-audience chart
+AUDIENCE_ORDER = [
+    "Children Ages 0-5",
+    "Children Ages 6-11",
+    "Teens Ages 12-18",
+    "Adults Ages 19+",
+    "Seniors",
+    "All Ages",
+]
+
+# The start time scatter leaves out the few very large events
+SCATTER_MAX_ATTENDANCE = 100
+
+# Comparison metrics: column name -> (frame name, column, aggregation)
+BRANCH_METRICS = {
+    "Avg monthly visits": ("visits_data_all", "value", "mean"),
+    "Checkouts": ("branch_titles_filtered", "x_of_checkouts", "sum"),
+    "Programs": ("public_calendar", "actual_attendance", "size"),
+    "Avg attendance": ("public_calendar", "actual_attendance", "mean"),
+}
+
+# Date indexes behind the date range filter:
+# name -> (frame name, group keys, date column, value columns, keep rows)
+DATE_INDEXES = {
+    "visits_data_all": ("visits_data_all", ["branch_name"], "month_date", ["value"], True),
+    "branch_physical_reading": ("branch_physical_reading", ["branch_name"], "month", [], True),
+    "public_calendar": ("public_calendar", ["branch_name"], "start_date", ["actual_attendance"], True),
+    "audiences": ("public_calendar", ["branch_name", "audiences"], "start_date", ["actual_attendance"], False),
+    "branch_titles_filtered": ("branch_titles_filtered", ["branch_name"], "checkout_month", ["x_of_checkouts"], False),
+    "genres": ("branch_titles_filtered", ["branch_name", "genre"], "checkout_month", ["x_of_checkouts"], False),
+    "reading_levels": (
+        "branch_titles_filtered", ["branch_name", "reading_level_item_cat2"], "checkout_month", ["x_of_checkouts"], False,
+    ),
+    "titles": (
+        "branch_titles_filtered", ["branch_name", "material_type_item_cat1", "title"], "checkout_month",
+        ["x_of_checkouts"], False,
+    ),
+}
+
+
+class BranchTables(dict):
+    """Finished per-branch tables; branches without rows get an empty table with the same columns."""
+
+    def __init__(self, tables, empty):
+        super().__init__(tables)
+        self.empty = empty
+
+    def __missing__(self, branch):
+        return self.empty
+
+
+def _top_per_branch(totals, n, rank, columns, names):
+    # Sort every branch's totals at once, keep each branch's top n rows and rank them
+    ordered = totals.sort_values(["branch_name", "checkouts"], ascending=[True, False], kind="stable")
+    top = ordered.groupby("branch_name", observed=True, sort=False).head(n).copy()
+    if rank:
+        top["rank"] = (
+            top.groupby("branch_name", observed=True)["checkouts"]
+               .rank(method="dense", ascending=False)
+        )
+
+    # Tables are small, so plain strings are cheaper to ship than categoricals
+    for col in top.columns:
+        if isinstance(top[col].dtype, pd.CategoricalDtype):
+            top[col] = top[col].astype(str)
+
+    return _per_branch(top.rename(columns=names), columns)
+
+
+def _per_branch(df, columns):
+    # One table per branch holding the given columns, in df's row order
+    tables = {
+        branch: rows[columns].reset_index(drop=True)
+        for branch, rows in df.groupby("branch_name", observed=True, sort=False)
+    }
+    return BranchTables(tables, df[columns].iloc[0:0].reset_index(drop=True))
+
+
+def _checkouts(df, keys):
+    # Counts are stored downcast; keep totals int64 whatever size the sums happen to fit
+    totals = df.groupby(keys, as_index=False, observed=True).agg(checkouts=('x_of_checkouts', 'sum'))
+    return totals.astype({"checkouts": "int64"})
+
+
+def circulation_totals(titles):
+    """Checkouts per branch and genre, reading level and title: everything the top-N tables rank."""
+    return {
+        "genres": _checkouts(titles, ["branch_name", "genre"]),
+        "reading_levels": _checkouts(titles, ["branch_name", "reading_level_item_cat2"]),
+        "titles": _checkouts(titles, ["branch_name", "material_type_item_cat1", "title"]),
+    }
+
+
+def _add_checkouts(totals, more):
+    keys = [col for col in totals.columns if col != "checkouts"]
+    return concat_rows([totals, more]).groupby(keys, as_index=False, observed=True).agg(checkouts=('checkouts', 'sum'))
+
+
+def update_circulation_rollups(rollups, new_titles):
+    """Rollups after new title rows are appended: only the new rows are aggregated, then
+    added to the running totals the tables are ranked from. Only the branches with new rows
+    are ranked again; every other branch keeps its tables."""
+    new_totals = circulation_totals(new_titles)
+    totals = {key: _add_checkouts(rollups["totals"][key], new_totals[key]) for key in new_totals}
+    changed = set(new_titles["branch_name"].dropna())
+    ranked = build_circulation_rollups(
+        totals={key: df[df["branch_name"].isin(changed)] for key, df in totals.items()}
+    )
+    updated = {"totals": totals}
+    for key, tables in ranked.items():
+        if key == "totals":
+            continue
+        previous = rollups[key]
+        branches = dict.fromkeys([*previous, *tables])
+        updated[key] = BranchTables(
+            {branch: tables[branch] if branch in changed else previous[branch] for branch in branches},
+            previous.empty,
+        )
+    return updated
+
+
+def build_circulation_rollups(titles=None, totals=None):
+    """Top genres, reading levels, books and DVDs for every branch, computed once from the
+    title-level rows (or from their circulation_totals)."""
+    if totals is None:
+        totals = circulation_totals(titles)
+    by_title = totals["titles"]
+    title_names = {'rank': 'Rank', 'material_type_item_cat1': 'Category', 'title': 'Title', 'checkouts': 'Checkouts'}
+    title_columns = ['Rank', 'Title', 'Category', 'Checkouts']
+
+    return {
+        "genres": _top_per_branch(
+            totals["genres"], TOP_GENRES, rank=True,
+            columns=['Rank', 'Genre', 'Checkouts'],
+            names={'rank': 'Rank', 'genre': 'Genre', 'checkouts': 'Checkouts'},
+        ),
+        "reading_levels": _top_per_branch(
+            totals["reading_levels"], TOP_TITLES, rank=False,
+            columns=['Reading level', 'Checkouts'],
+            names={'reading_level_item_cat2': 'Reading level', 'checkouts': 'Checkouts'},
+        ),
+        "books": _top_per_branch(
+            by_title[by_title["material_type_item_cat1"].isin(BOOK_MATERIALS)], TOP_TITLES, rank=True,
+            columns=title_columns, names=title_names,
+        ),
+        "dvds": _top_per_branch(
+            by_title[by_title["material_type_item_cat1"].isin(DVD_MATERIALS)], TOP_TITLES, rank=True,
+            columns=title_columns, names=title_names,
+        ),
+        "totals": totals,
+    }
+
+
+def circulation_for_dates(indexes, branch, start, end):
+    """build_circulation_rollups for one branch, from its checkouts dated start to end."""
+    def totals(name):
+        table = indexes[name].totals(branch, start, end)
+        return table[indexes[name].keys + ["x_of_checkouts"]].rename(columns={"x_of_checkouts": "checkouts"}).astype(
+            {"checkouts": "int64"}
+        )
+
+    return build_circulation_rollups(
+        totals={"genres": totals("genres"), "reading_levels": totals("reading_levels"), "titles": totals("titles")}
+    )
+
+
+def _audience_tables(by_audience):
+    by_audience["audiences"] = pd.Categorical(by_audience["audiences"], categories=AUDIENCE_ORDER, ordered=True)
+    return _per_branch(
+        by_audience.sort_values(["branch_name", "audiences"], kind="stable"),
+        ["audiences", "avg_attendance", "total_programs"],
+    )
+
+
+def build_attendance_rollups(calendar, max_points=MAX_POINTS):
+    """Average attendance by audience and the start time scatter, for every branch."""
+    by_audience = calendar.groupby(["branch_name", "audiences"], observed=True, as_index=False).agg(
+        avg_attendance=('actual_attendance', 'mean'),
+        total_programs=('actual_attendance', 'count'),
+    )
+    return {"by_audience": _audience_tables(by_audience), "scatter": _scatter_tables(calendar, max_points)}
+
+
+def attendance_for_dates(indexes, branch, start, end, max_points=MAX_POINTS):
+    """build_attendance_rollups for one branch, from its events dated start to end."""
+    audiences = indexes["audiences"].totals(branch, start, end)
+    by_audience = audiences[["branch_name", "audiences"]].assign(
+        avg_attendance=audiences["actual_attendance"] / audiences["actual_attendance_count"],
+        total_programs=audiences["actual_attendance_count"],
+    )
+    events = indexes["public_calendar"].rows(branch, start, end)
+    return {"by_audience": _audience_tables(by_audience), "scatter": _scatter_tables(events, max_points)}
+
+
+def _scatter_tables(calendar, max_points):
+    # Scatter rows per branch as (rows, None); busy branches get their density buckets here
+    # instead of on every render, as (buckets, attendance step)
+    points = calendar[calendar["actual_attendance"] < SCATTER_MAX_ATTENDANCE]
+    scatter = BranchTables({}, (points.iloc[0:0], None))
+    for branch, rows in points.groupby("branch_name", observed=True, sort=False):
+        if len(rows) > max_points:
+            scatter[branch] = density_bins(rows, "time_parsed", "actual_attendance", max_points, "title")
+        else:
+            scatter[branch] = (rows, None)
+    return scatter
+
+
+def build_branch_metrics(branches, frames):
+    """Visits, circulation and attendance metrics for every branch, each next to the branch's
+    system-wide percentile.
+
+    One groupby per metric covers all branches at once; rows follow the branches crosswalk,
+    with NaN where a branch has no rows in a source.
+    """
+    totals = {
+        name: frames[frame].groupby("branch_name", observed=True)[column].agg(how)
+        for name, (frame, column, how) in BRANCH_METRICS.items()
+    }
+    return _with_percentiles(branches, totals)
+
+
+def branch_metrics_for_dates(branches, frames, indexes, start, end):
+    """build_branch_metrics over the rows dated start to end, from the date indexes' running totals.
+    Metrics of frames without a date index cover all their rows."""
+    totals = {}
+    for name, (frame, column, how) in BRANCH_METRICS.items():
+        if frame not in indexes:
+            totals[name] = frames[frame].groupby("branch_name", observed=True)[column].agg(how)
+            continue
+        sums = indexes[frame].totals(None, start, end).set_index("branch_name")
+        totals[name] = {
+            "sum": sums[column],
+            "mean": sums[column] / sums[f"{column}_count"],
+            "size": sums["rows"],
+        }[how]
+    return _with_percentiles(branches, totals)
+
+
+def _with_percentiles(branches, totals):
+    # One row per branch in the crosswalk: each metric followed by its percentile
+    columns = {}
+    for name, values in totals.items():
+        values = values.set_axis(values.index.astype(str)).reindex(branches).astype(float)
+        columns[name] = values
+        columns[f"{name} pct"] = values.rank(pct=True).mul(100).round()
+    metrics = pd.DataFrame(columns)
+    metrics.index.name = "Branch"
+    return metrics
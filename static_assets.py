@@ -0,0 +1,138 @@
+"""Serve the logo and branch maps as static files under content-hashed URLs.
+
+    python static_assets.py                    # list the assets and their URLs
+    python static_assets.py --webp --width 480 # also write WebP and downsized variants (needs Pillow)
+
+Each file's URL carries a hash of its contents, so browsers can keep it for a year and
+never ask again; a changed map gets a new URL. Variants are written under
+<assets dir>/.variants/ and used whenever they are newer than their original.
+"""
+import argparse
+import hashlib
+import mimetypes
+import os
+from pathlib import Path
+
+from htmltools import tags
+
+ASSETS_DIR = Path(os.environ.get("CPL_ASSETS_DIR", Path(__file__).resolve().parent / "cplbranches"))
+ASSETS_URL = "/assets"
+VARIANTS_DIR_NAME = ".variants"
+
+# Files served from the assets directory, relative to it
+ASSET_PATTERNS = ["cpl-logo.svg", "maps/*.png"]
+
+# Hashed URLs never change content, so browsers and proxies can keep them indefinitely
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _hashed_name(relative, digest):
+    path = Path(relative)
+    return str(path.with_name(f"{path.stem}.{digest}{path.suffix}"))
+
+
+class AssetManifest:
+    """Content-hashed URL for every asset, plus the file behind each URL."""
+
+    def __init__(self, root=ASSETS_DIR):
+        self.root = Path(root)
+        self.urls = {}   # relative path -> {"src": url, "webp": url or None}
+        self.files = {}  # hashed path under ASSETS_URL -> (file, ETag)
+        for pattern in ASSET_PATTERNS:
+            for path in sorted(self.root.glob(pattern)):
+                relative = path.relative_to(self.root).as_posix()
+                self.urls[relative] = {
+                    "src": self._add(relative, self._variant(path, path.suffix) or path),
+                    "webp": self._add(relative, self._variant(path, ".webp")),
+                }
+
+    def _variant(self, original, suffix):
+        # A variant is only used while it's at least as new as the file it was made from
+        variant = (self.root / VARIANTS_DIR_NAME / original.relative_to(self.root)).with_suffix(suffix)
+        if variant.exists() and variant.stat().st_mtime >= original.stat().st_mtime:
+            return variant
+        return None
+
+    def _add(self, relative, path):
+        if path is None:
+            return None
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()[:12]
+        hashed = _hashed_name(Path(relative).with_suffix(path.suffix), digest)
+        self.files[hashed] = (path, f'"{digest}"')
+        return f"{ASSETS_URL}/{hashed}"
+
+    def url(self, relative):
+        return self.urls.get(relative, {}).get("src")
+
+    def image(self, relative, alt="", **attrs):
+        """<img> for an asset, wrapped in a <picture> offering its WebP variant when there is one."""
+        urls = self.urls.get(relative)
+        if urls is None:
+            return tags.img(alt=alt, **attrs)
+        img = tags.img(src=urls["src"], alt=alt, **attrs)
+        if urls["webp"] is None:
+            return img
+        return tags.picture(tags.source(srcset=urls["webp"], type="image/webp"), img)
+
+
+def with_static_assets(shiny_app, manifest):
+    """Serve shiny_app with manifest's files under ASSETS_URL, cached for good by the browser."""
+    from starlette.applications import Starlette
+    from starlette.responses import FileResponse, Response
+    from starlette.routing import Mount, Route
+
+    async def asset_endpoint(request):
+        asset = manifest.files.get(request.path_params["path"])
+        if asset is None:
+            return Response(status_code=404)
+        path, etag = asset
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+        return FileResponse(path, media_type=mimetypes.guess_type(path.name)[0], headers=headers)
+
+    return Starlette(routes=[Route(ASSETS_URL + "/{path:path}", asset_endpoint), Mount("/", app=shiny_app)])
+
+
+def write_variants(root=ASSETS_DIR, webp=True, width=None):
+    """Write WebP copies and/or copies at most width pixels wide of every raster asset."""
+    from PIL import Image
+
+    written = []
+    for pattern in ASSET_PATTERNS:
+        for path in sorted(Path(root).glob(pattern)):
+            if path.suffix == ".svg":
+                continue
+            target = Path(root) / VARIANTS_DIR_NAME / path.relative_to(root)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with Image.open(path) as img:
+                if width and img.width > width:
+                    img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+                    img.save(target, optimize=True)
+                    written.append(target)
+                if webp:
+                    if img.mode not in ("RGB", "RGBA"):
+                        img = img.convert("RGBA")
+                    img.save(target.with_suffix(".webp"), "WEBP", quality=85, method=6)
+                    written.append(target.with_suffix(".webp"))
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List the CPL static assets and write their variants")
+    parser.add_argument("--assets-dir", default=ASSETS_DIR)
+    parser.add_argument("--webp", action="store_true", help="write a WebP copy of every raster asset")
+    parser.add_argument("--width", type=int, help="write copies at most this many pixels wide")
+    args = parser.parse_args()
+
+    if args.webp or args.width:
+        try:
+            written = write_variants(args.assets_dir, args.webp, args.width)
+        except ImportError:
+            parser.exit(1, "WebP and resized variants need Pillow (pip install pillow)\n")
+        total = sum(path.stat().st_size for path in written)
+        print(f"Wrote {len(written)} variants ({total / 1024:.0f} KB)")
+
+    manifest = AssetManifest(args.assets_dir)
+    for relative, urls in manifest.urls.items():
+        print(relative, urls["src"], urls["webp"] or "")
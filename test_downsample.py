@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from downsample import density_bins, lttb_indices
+
+
+def test_lttb_keeps_ends_and_peaks():
+    y = np.zeros(1000)
+    y[437] = 50
+    keep = lttb_indices(np.arange(1000), y, 50)
+    assert len(keep) == 50
+    assert keep[0] == 0 and keep[-1] == 999
+    assert np.all(np.diff(keep) > 0)
+    assert 437 in keep
+
+
+@pytest.mark.parametrize("n", [2, 10, 11])
+def test_lttb_keeps_short_series_whole(n):
+    assert list(lttb_indices(np.arange(10), np.arange(10), n)) == list(range(10))
+
+
+def test_density_bins_count_every_event():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "time": rng.integers(0, 48, 5000),
+        "attendance": rng.integers(0, 100, 5000),
+        "title": "Event",
+    })
+    buckets, step = density_bins(df, "time", "attendance", 500, "title")
+    assert len(buckets) <= 500
+    assert step > 1 and step & (step - 1) == 0
+    assert buckets["events"].sum() == len(df)
+    assert (buckets["attendance"] % step == 0).all()
+
+    buckets, step = density_bins(df.head(100), "time", "attendance", 500, "title")
+    assert step == 1
+    assert buckets["events"].sum() == 100
+
+
+def test_density_bins_keep_busiest_buckets_as_last_resort():
+    df = pd.DataFrame({"time": np.arange(100), "attendance": 1, "title": "Event"})
+    df = pd.concat([df, df.head(5)])
+    buckets, _ = density_bins(df, "time", "attendance", 5, "title")
+    assert list(buckets["time"]) == [0, 1, 2, 3, 4]
+    assert (buckets["events"] == 2).all()
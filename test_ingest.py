@@ -0,0 +1,102 @@
+import types
+
+import pandas as pd
+import pytest
+
+from bench import synthetic_data
+from datastore import DataStore, load_frame
+from ingest import add_delta, validate_delta
+from rollups import build_circulation_rollups, update_circulation_rollups
+
+
+def assert_same_rollups(a, b):
+    for key in ("genres", "reading_levels", "books", "dvds"):
+        assert set(a[key]) == set(b[key])
+        for branch in a[key]:
+            pd.testing.assert_frame_equal(a[key][branch].reset_index(drop=True), b[key][branch].reset_index(drop=True))
+    for key, totals in a["totals"].items():
+        keys = [col for col in totals.columns if col != "checkouts"]
+
+        def normalized(df):
+            return df.astype({col: str for col in keys}).sort_values(keys, ignore_index=True)
+
+        pd.testing.assert_frame_equal(normalized(totals), normalized(b["totals"][key]))
+
+
+# Incremental reloads
+
+def build_circulation(frames, previous=None, appended=None):
+    # The circulation part of app.build_branch_data
+    appended = appended or {}
+    if "branch_titles_filtered" in appended:
+        circulation = update_circulation_rollups(previous.circulation, appended["branch_titles_filtered"])
+    else:
+        circulation = build_circulation_rollups(frames["branch_titles_filtered"])
+    return types.SimpleNamespace(**frames, circulation=circulation)
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    synthetic_data(tmp_path, branches=8)
+    # A tenth of the title rows is plenty here
+    titles = tmp_path / "branch_titles_filtered.csv"
+    pd.read_csv(titles).sample(frac=0.1, random_state=0).to_csv(titles, index=False)
+    return tmp_path
+
+
+def write_titles_delta(data_dir, month, path, branches=None):
+    rows = pd.read_csv(data_dir / "branch_titles_filtered.csv")
+    if branches is not None:
+        rows = rows[rows["branch_name"].isin(branches)]
+    rows = rows.sample(500, random_state=1)
+    rows["checkout_month"] = month
+    # Titles and genres the base rows don't have, so new categories get appended too
+    rows.iloc[:50, rows.columns.get_loc("title")] = "A Brand New Title"
+    rows.iloc[:20, rows.columns.get_loc("genre")] = "Genre New"
+    rows.to_csv(path, index=False)
+    return path
+
+
+def test_incremental_reload_equals_full_reload(data_dir, tmp_path_factory):
+    store = DataStore(build_circulation, data_dir)
+    deltas = tmp_path_factory.mktemp("deltas")
+    for month in ("2025-01-01", "2025-02-01"):
+        add_delta("branch_titles_filtered", write_titles_delta(data_dir, month, deltas / f"{month}.csv"), data_dir)
+        assert store.reload_if_changed()
+
+    fresh = DataStore(build_circulation, data_dir).current
+    assert store.current.version == fresh.version
+    pd.testing.assert_frame_equal(
+        store.current.branch_titles_filtered.astype({"title": str}),
+        fresh.branch_titles_filtered.astype({"title": str}),
+    )
+    assert_same_rollups(store.current.circulation, fresh.circulation)
+    assert_same_rollups(
+        store.current.circulation,
+        build_circulation_rollups(load_frame("branch_titles_filtered", data_dir, use_cache=False)),
+    )
+
+
+def test_reload_of_some_branches_keeps_the_others_tables(data_dir, tmp_path):
+    store = DataStore(build_circulation, data_dir)
+    previous = store.current.circulation
+    branches = sorted(previous["books"])[:2]
+    add_delta("branch_titles_filtered", write_titles_delta(data_dir, "2025-01-01", tmp_path / "delta.csv", branches), data_dir)
+    assert store.reload_if_changed()
+
+    circulation = store.current.circulation
+    for key in ("genres", "reading_levels", "books", "dvds"):
+        for branch in circulation[key]:
+            assert (circulation[key][branch] is previous[key][branch]) == (branch not in branches)
+    assert_same_rollups(circulation, DataStore(build_circulation, data_dir).current.circulation)
+
+
+def test_delta_for_stored_months_or_unknown_branches_is_rejected(data_dir, tmp_path):
+    path = write_titles_delta(data_dir, "2024-12-01", tmp_path / "repeat.csv")
+    with pytest.raises(ValueError, match="already stored"):
+        validate_delta("branch_titles_filtered", path, data_dir)
+
+    rows = pd.read_csv(path).assign(checkout_month="2025-01-01", branch_name="Nowhere")
+    rows.to_csv(path, index=False)
+    with pytest.raises(ValueError, match="not in the crosswalk: Nowhere"):
+        validate_delta("branch_titles_filtered", path, data_dir)
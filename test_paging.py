@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import datastore
+from paging import PAGE_SIZE, SortedTable, sorted_tables
+from rollups import BranchTables, build_circulation_rollups
+
+
+@pytest.fixture
+def table():
+    rng = np.random.default_rng(0)
+    n = PAGE_SIZE * 2 + 10
+    return pd.DataFrame({
+        "Rank": np.arange(1, n + 1),
+        "Title": [f"Title {i}" if i % 7 else f"Special {i}" for i in rng.permutation(n)],
+        "Checkouts": rng.integers(0, 20, n),
+    })
+
+
+@pytest.mark.parametrize("sort, descending, query", [
+    (None, False, ""),
+    ("Checkouts", True, ""),
+    ("Title", False, "special"),
+    ("Checkouts", False, "TITLE 1"),
+])
+def test_pages_match_sorting_and_filtering(table, sort, descending, query):
+    expected = table[table["Title"].str.lower().str.contains(query.lower(), regex=False)]
+    if sort is not None:
+        expected = expected.sort_values(sort, ascending=not descending, kind="stable")
+    sorted_table = SortedTable(table)
+    pages = [sorted_table.page(number, sort, descending, query) for number in range(len(expected) // PAGE_SIZE + 1)]
+    assert all(total == len(expected) for _, _, total in pages)
+    pd.testing.assert_frame_equal(pd.concat([rows for rows, _, _ in pages]), expected)
+
+
+def test_page_numbers_are_clamped(table):
+    sorted_table = SortedTable(table)
+    rows, start, total = sorted_table.page(99)
+    assert (start, total, len(rows)) == (PAGE_SIZE * 2, len(table), 10)
+    assert sorted_table.page(-1)[1] == 0
+
+    rows, start, total = sorted_table.page(3, query="no such title")
+    assert (len(rows), start, total) == (0, 0, 0)
+    rows, start, total = SortedTable(table.iloc[0:0]).page(0)
+    assert (len(rows), start, total) == (0, 0, 0)
+
+
+def test_filter_matches_titles_in_shared_mode(tmp_path, monkeypatch):
+    # Shared mode keeps titles as Arrow strings all the way into the tables
+    monkeypatch.setattr(datastore, "SHARED", True)
+    pd.DataFrame({
+        "branch_name": "A",
+        "title": ["Title 1", "Title 10", "Title 2", "Other"],
+        "material_type_item_cat1": "BOOKS",
+        "reading_level_item_cat2": "ADULT",
+        "genre": "Fiction",
+        "checkout_month": "2024-01-01",
+        "x_of_checkouts": [4, 3, 2, 1],
+    }).to_csv(tmp_path / datastore.DATA_FILES["branch_titles_filtered"], index=False)
+    titles = datastore.read_source("branch_titles_filtered", tmp_path)
+    assert isinstance(titles["title"].dtype, pd.ArrowDtype)
+
+    books = sorted_tables(build_circulation_rollups(titles)["books"])["A"]
+    rows, _, total = books.page(0, query="title 1")
+    assert total == 2
+    assert list(rows["Title"].astype(str)) == ["Title 1", "Title 10"]
+
+
+def test_only_changed_branches_are_sorted_again(table):
+    empty = table.iloc[0:0]
+    previous = sorted_tables(BranchTables({"A": table, "B": table}, empty))
+    tables = sorted_tables(BranchTables({"A": table, "B": table.iloc[:5], "C": table}, empty), previous, {"B", "C"})
+    assert tables["A"] is previous["A"]
+    assert len(tables["B"]) == 5 and len(tables["C"]) == len(table)
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from datastore import append_rows
+from time_index import RangeIndex
+
+
+@pytest.fixture
+def dated():
+    rng = np.random.default_rng(0)
+    n = 3000
+    df = pd.DataFrame({
+        "branch_name": pd.Categorical(rng.choice(["A", "B", "C", None], n, p=[0.4, 0.3, 0.25, 0.05])),
+        "kind": pd.Categorical(rng.choice(["x", "y", "z"], n)),
+        # Reaches back before 1970, where day numbers are negative
+        "day": pd.Timestamp("1965-01-01") + pd.to_timedelta(rng.integers(0, 365 * 70, n), unit="D"),
+        "value": rng.integers(0, 100, n).astype(float),
+    })
+    df.loc[rng.random(n) < 0.1, "value"] = np.nan
+    df.loc[rng.random(n) < 0.02, "day"] = pd.NaT
+    return df
+
+
+RANGES = [
+    (None, None),
+    ("1990-03-01", "1990-03-31"),
+    ("1969-12-15", "1970-01-15"),
+    ("1965-01-01", "1965-01-01"),
+    ("2050-01-01", None),
+    (None, "1960-01-01"),
+]
+
+
+@pytest.mark.parametrize("rows", [False, True])
+@pytest.mark.parametrize("start, end", RANGES)
+def test_range_totals_match_filtering(dated, rows, start, end):
+    index = RangeIndex(dated, ["branch_name", "kind"], "day", ["value"], rows=rows)
+    mask = dated["day"].notna() & dated["branch_name"].notna()
+    if start is not None:
+        mask &= dated["day"] >= start
+    if end is not None:
+        mask &= dated["day"] <= end
+    expected = dated[mask].groupby(["branch_name", "kind"], observed=True, as_index=False).agg(
+        value=("value", "sum"), value_count=("value", "count"), rows=("value", "size"),
+    )
+    got = index.totals(None, start, end)[list(expected.columns)]
+    pd.testing.assert_frame_equal(
+        got.astype({"branch_name": str, "kind": str}),
+        expected.astype({"branch_name": str, "kind": str}),
+        check_dtype=False,
+    )
+
+    branch = index.totals("B", start, end)[list(expected.columns)]
+    pd.testing.assert_frame_equal(
+        branch.astype({"branch_name": str, "kind": str}),
+        got[got["branch_name"] == "B"].astype({"branch_name": str, "kind": str}).reset_index(drop=True),
+    )
+
+
+@pytest.mark.parametrize("start, end", RANGES)
+def test_range_rows_match_filtering(dated, start, end):
+    index = RangeIndex(dated, ["branch_name"], "day", ["value"], rows=True)
+    mask = (dated["branch_name"] == "A") & dated["day"].notna()
+    if start is not None:
+        mask &= dated["day"] >= start
+    if end is not None:
+        mask &= dated["day"] <= end
+    expected = dated[mask].sort_values("day", kind="stable")
+    assert list(index.rows("A", start, end).index) == list(expected.index)
+
+
+def test_range_index_edges(dated):
+    index = RangeIndex(dated, ["branch_name"], "day", ["value"], rows=True)
+    assert index.rows("Nowhere").empty
+    assert index.totals("Nowhere").empty
+    valid = dated[dated["branch_name"].notna()]["day"]
+    assert index.span == (valid.min(), valid.max())
+
+    empty = RangeIndex(dated.iloc[0:0], ["branch_name"], "day", ["value"])
+    assert empty.span is None
+    assert empty.totals().empty
+
+
+@pytest.mark.parametrize("rows", [False, True])
+def test_append_matches_full_build(dated, rows):
+    old, new = dated.iloc[:2500], dated.iloc[2500:].copy()
+    # The new rows bring a branch and a kind the old ones didn't have, and repeat some
+    # of the old rows' groups and days
+    new["branch_name"] = new["branch_name"].cat.add_categories("D")
+    new.loc[new.index[:50], "branch_name"] = "D"
+    new["kind"] = new["kind"].cat.add_categories("w")
+    new.loc[new.index[50:100], "kind"] = "w"
+    new = pd.concat([new, old.iloc[:200]], ignore_index=True)
+    new[["branch_name", "kind"]] = new[["branch_name", "kind"]].astype("category")
+    df = append_rows(old, [new])
+
+    keys = ["branch_name", "kind"]
+    appended = RangeIndex(old, keys, "day", ["value"], rows=rows).append(df, new)
+    full = RangeIndex(df, keys, "day", ["value"], rows=rows)
+    pd.testing.assert_frame_equal(appended.groups, full.groups)
+    assert appended.span == full.span
+    for start, end in RANGES:
+        pd.testing.assert_frame_equal(appended.totals(None, start, end), full.totals(None, start, end))
+        pd.testing.assert_frame_equal(appended.totals("D", start, end), full.totals("D", start, end))
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from title_search import TitleIndex, _one_edit
+
+
+@pytest.fixture
+def title_index():
+    return TitleIndex(pd.DataFrame({
+        "branch_name": ["A", "B", "A", "B", "A", "C"],
+        "material_type_item_cat1": "BOOKS",
+        "title": [
+            "Harry Potter and the Goblet of Fire", "Harry Potter and the Goblet of Fire",
+            "The Hobbit", "Pottery Basics", "Café Society", "Harry Potter and the Goblet of Fire",
+        ],
+        "checkouts": [5, 7, 3, 2, 4, 1],
+    }))
+
+
+def found(result):
+    rows, matched = result
+    return list(dict.fromkeys(rows["title"])), matched
+
+
+def test_title_search_matches(title_index):
+    assert found(title_index.search("hobbit")) == (["The Hobbit"], 1)
+    assert found(title_index.search("hobit")) == (["The Hobbit"], 1)
+    assert found(title_index.search("harry poter goblet")) == (["Harry Potter and the Goblet of Fire"], 1)
+    assert found(title_index.search("cafe")) == (["Café Society"], 1)
+    # The exact word ranks above the prefix match
+    assert found(title_index.search("potter")) == (["Harry Potter and the Goblet of Fire", "Pottery Basics"], 2)
+    assert found(title_index.search("potter", limit=1)) == (["Harry Potter and the Goblet of Fire"], 2)
+
+
+def test_title_search_returns_every_branch_busiest_first(title_index):
+    rows, _ = title_index.search("goblet")
+    assert list(rows["branch_name"]) == ["B", "A", "C"]
+
+
+def test_title_search_without_matches(title_index):
+    assert found(title_index.search("")) == ([], 0)
+    assert found(title_index.search("  !! ")) == ([], 0)
+    assert found(title_index.search("zebra")) == ([], 0)
+    # Short words don't match with a typo
+    assert found(title_index.search("hobbit xo")) == ([], 0)
+
+
+def _edit_distance(a, b):
+    # Optimal string alignment distance: substitutions, insertions, deletions and swaps
+    d = np.zeros((len(a) + 1, len(b) + 1), dtype=int)
+    d[:, 0] = range(len(a) + 1)
+    d[0, :] = range(len(b) + 1)
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            d[i, j] = min(d[i - 1, j] + 1, d[i, j - 1] + 1, d[i - 1, j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                d[i, j] = min(d[i, j], d[i - 2, j - 2] + 1)
+    return d[len(a), len(b)]
+
+
+def test_one_edit_matches_edit_distance():
+    rng = np.random.default_rng(0)
+    for _ in range(3000):
+        a = "".join(rng.choice(list("abc"), rng.integers(0, 6)))
+        b = "".join(rng.choice(list("abc"), rng.integers(0, 6)))
+        assert _one_edit(a, b) == (_edit_distance(a, b) <= 1), (a, b)
+
+
+def test_extended_index_matches_fresh_build():
+    totals = pd.DataFrame({
+        "branch_name": ["A", "B", "A", "B", "A"],
+        "material_type_item_cat1": "BOOKS",
+        "title": ["The Hobbit", "Pottery Basics", "Café Society", "The Hobbit", "Dune"],
+        "checkouts": [3, 2, 4, 1, 6],
+    })
+    # A month later: new titles, some sharing words with the old ones, sorted in among them
+    more = pd.concat([totals, pd.DataFrame({
+        "branch_name": ["A", "C", "B", "C"],
+        "material_type_item_cat1": "BOOKS",
+        "title": ["Harry Potter", "The Hobbit", "Dune Messiah", "Basic Pottery Glazes"],
+        "checkouts": [5, 2, 1, 3],
+    })]).sort_values(["branch_name", "title"], ignore_index=True)
+
+    extended = TitleIndex(more, previous=TitleIndex(totals))
+    fresh = TitleIndex(more)
+    assert extended.terms == fresh.terms
+    assert len(extended.postings) == len(fresh.postings)
+    for got, expected in zip(extended.postings, fresh.postings):
+        np.testing.assert_array_equal(got, expected)
+    np.testing.assert_array_equal(extended._variant_hashes, fresh._variant_hashes)
+    np.testing.assert_array_equal(extended._variant_terms, fresh._variant_terms)
+    for query in ["pottery", "hobit", "dune", "basic glaze", "harry"]:
+        pd.testing.assert_frame_equal(extended.search(query)[0], fresh.search(query)[0])
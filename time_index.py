@@ -0,0 +1,150 @@
+import copy
+
+import numpy as np
+import pandas as pd
+
+# Each row's group and day are packed into one sortable int64: the group code above
+# _DAY_BITS bits of day number (days since 1970, offset so earlier dates stay positive)
+_DAY_BITS = 20
+_DAY_OFFSET = 1 << (_DAY_BITS - 1)
+_LAST_DAY = (1 << _DAY_BITS) - 1
+
+
+def _day(when, default):
+    if when is None:
+        return default
+    return int(np.datetime64(pd.Timestamp(when), "D").astype(np.int64)) + _DAY_OFFSET
+
+
+class RangeIndex:
+    """A frame's rows sorted by group and date, with running totals of its value columns.
+
+    Groups are the distinct values of keys, the first of which is the branch. Finding a
+    group's rows in any date range is one binary search per end, and the sum over those rows
+    is the difference of two running totals, so a range query never filters or regroups
+    the frame. With rows=False the rows are first summed per group and day (enough for
+    totals, and much smaller); with rows=True the index can also return the rows themselves.
+    """
+
+    def __init__(self, df, keys, time, values=(), rows=False):
+        self.keys = list(keys)
+        self.time = time
+        self.values = list(values)
+        groups = df.groupby(self.keys, observed=True, sort=True)
+        codes = groups.ngroup().to_numpy()
+        # One row of key values per group code
+        self.groups = groups.size().index.to_frame(index=False)
+
+        days = df[time].to_numpy("datetime64[D]").astype(np.int64) + _DAY_OFFSET
+        valid = ~np.isnan(codes) & df[time].notna().to_numpy()
+        packed = (codes[valid].astype(np.int64) << _DAY_BITS) | days[valid]
+        columns = {col: df[col].to_numpy(dtype=float)[valid] for col in self.values}
+
+        if rows:
+            order = np.argsort(packed, kind="stable")
+            self.frame = df
+            self.positions = np.flatnonzero(valid)[order]
+            self._packed = packed[order]
+            counts = {"rows": np.ones(len(order))}
+            for col, x in columns.items():
+                counts[col] = np.nan_to_num(x[order])
+                counts[f"{col}_count"] = ~np.isnan(x[order])
+        else:
+            # Sum rows sharing a group and day into one entry
+            self.frame = self.positions = None
+            self._packed, inverse = np.unique(packed, return_inverse=True)
+            counts = {"rows": np.bincount(inverse, minlength=len(self._packed))}
+            for col, x in columns.items():
+                counts[col] = np.bincount(inverse, weights=np.nan_to_num(x), minlength=len(self._packed))
+                counts[f"{col}_count"] = np.bincount(inverse, weights=~np.isnan(x), minlength=len(self._packed))
+        self._summarize(counts)
+
+    def _summarize(self, counts):
+        # Running totals over the sorted entries, and the branch codes and span to go with them
+        self._running = {name: np.r_[0, np.cumsum(x)] for name, x in counts.items()}
+
+        # Group codes of each branch, which are contiguous because the branch is the first key
+        self._branch_codes = {}
+        branch_codes, names = pd.factorize(self.groups[self.keys[0]])
+        if len(branch_codes):
+            bounds = np.flatnonzero(np.diff(branch_codes)) + 1
+            for start, stop in zip(np.r_[0, bounds], np.r_[bounds, len(branch_codes)]):
+                self._branch_codes[names[branch_codes[start]]] = np.arange(start, stop)
+
+        self.span = None
+        if len(self._packed):
+            day_values = (self._packed & _LAST_DAY) - _DAY_OFFSET
+            self.span = (
+                pd.Timestamp(np.datetime64(int(day_values.min()), "D")),
+                pd.Timestamp(np.datetime64(int(day_values.max()), "D")),
+            )
+
+    def append(self, df, new_rows):
+        """This index once new_rows are appended to its frame, df being the frame afterwards.
+
+        With rows=False only new_rows are grouped; their entries are merged into the existing
+        sorted ones, which is what a reload with a month of deltas needs. With rows=True the
+        frame's row positions all move when the new rows are regrouped by branch, so the
+        index is built again from df.
+        """
+        if self.frame is not None:
+            return RangeIndex(df, self.keys, self.time, self.values, rows=True)
+        added = RangeIndex(new_rows, self.keys, self.time, self.values)
+
+        # Group codes of both indexes in the combined group table, sorted as df would sort it
+        both = pd.concat([self.groups, added.groups], ignore_index=True)
+        both = both.astype({key: df[key].dtype for key in self.keys})
+        groups = both.groupby(self.keys, observed=True, sort=True)
+        codes = groups.ngroup().to_numpy().astype(np.int64)
+        old_codes, new_codes = codes[:len(self.groups)], codes[len(self.groups):]
+
+        def remap(index, codes):
+            return (codes[index._packed >> _DAY_BITS] << _DAY_BITS) | (index._packed & _LAST_DAY)
+
+        # Both sides are already sorted, so the stable sort only merges two runs
+        packed = np.concatenate([remap(self, old_codes), remap(added, new_codes)])
+        order = np.argsort(packed, kind="stable")
+        packed = packed[order]
+        # Entries for a group and day present on both sides are summed into one
+        first = np.ones(len(packed), dtype=bool)
+        first[1:] = packed[1:] != packed[:-1]
+        entry = np.cumsum(first) - 1
+
+        index = copy.copy(self)
+        index.groups = groups.size().index.to_frame(index=False)
+        index._packed = packed[first]
+        counts = {}
+        for name, running in self._running.items():
+            x = np.concatenate([np.diff(running), np.diff(added._running[name])])[order]
+            counts[name] = np.bincount(entry, weights=x, minlength=len(index._packed)).astype(running.dtype)
+        index._summarize(counts)
+        return index
+
+    def _bounds(self, codes, start, end):
+        codes = codes.astype(np.int64) << _DAY_BITS
+        lo = np.searchsorted(self._packed, codes | _day(start, 0), side="left")
+        hi = np.searchsorted(self._packed, codes | _day(end, _LAST_DAY), side="right")
+        return lo, hi
+
+    def rows(self, branch, start=None, end=None):
+        """branch's rows dated from start to end (inclusive), in date order. Needs rows=True."""
+        codes = self._branch_codes.get(branch)
+        if codes is None:
+            return self.frame.iloc[0:0]
+        lo, hi = self._bounds(codes, start, end)
+        return self.frame.iloc[np.concatenate([self.positions[a:b] for a, b in zip(lo, hi)])]
+
+    def totals(self, branch=None, start=None, end=None):
+        """Per group from start to end: key columns, then each value column's sum and non-missing
+        count (<col>_count) and the number of rows. Only branch's groups if given; groups without
+        rows in the range are left out."""
+        if branch is None:
+            codes = np.arange(len(self.groups))
+        else:
+            codes = self._branch_codes.get(branch, np.arange(0))
+        lo, hi = self._bounds(codes, start, end)
+        table = self.groups.iloc[codes].reset_index(drop=True)
+        for name, running in self._running.items():
+            table[name] = running[hi] - running[lo]
+        table = table.astype({"rows": "int64", **{f"{col}_count": "int64" for col in self.values}})
+        return table[table["rows"] > 0].reset_index(drop=True)
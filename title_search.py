@@ -0,0 +1,190 @@
+import re
+import unicodedata
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+# Matching titles shown per search, best matches first
+SEARCH_LIMIT = 20
+
+# Words shorter than this only match exactly or as a prefix; longer ones also match
+# with one typo (a wrong, missing, extra or swapped letter)
+MIN_FUZZY_LENGTH = 4
+
+# Prefixes shorter than this only match exactly, so "a" doesn't pull in half the catalog
+MIN_PREFIX_LENGTH = 2
+
+# Match quality per query word
+EXACT, PREFIX, FUZZY = 3, 2, 1
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def words(text):
+    """Lower-cased words of a title or query, with accents removed."""
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode()
+    return _WORD.findall(text.lower())
+
+
+def _variants(word):
+    # The word and every version of it with one letter deleted
+    return {word, *(word[:i] + word[i + 1:] for i in range(len(word)))}
+
+
+def _one_edit(a, b):
+    """True if a and b differ by at most one substitution, insertion, deletion or swap."""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:] or (a[i + 1:i + 2] == b[i:i + 1] and a[i:i + 1] == b[i + 1:i + 2] and a[i + 2:] == b[i + 2:])
+    return a[i:] == b[i + 1:]
+
+
+class TitleIndex:
+    """Inverted index from title words to the per-branch checkout totals of each title.
+
+    Built once per data version from the title totals of the circulation rollups
+    (branch, material, title, checkouts). A search looks its words up in the vocabulary,
+    intersects the posting lists and returns every branch's row for the best matching
+    titles, without touching the title-level data.
+
+    Given the previous version's index, only titles it didn't have are split into words;
+    its postings and typo variants are carried over to the new title and term numbers.
+    """
+
+    def __init__(self, totals, previous=None):
+        codes, titles = pd.factorize(totals["title"])
+        self.titles = np.asarray(titles.astype(str), dtype=object)
+
+        # Rows of totals grouped by title, busiest branch first
+        order = np.lexsort((-totals["checkouts"].to_numpy(), codes))
+        self.rows = totals.iloc[order].reset_index(drop=True)
+        self._starts = np.r_[0, np.cumsum(np.bincount(codes, minlength=len(titles)))]
+        self.checkouts = np.bincount(codes, weights=totals["checkouts"].to_numpy(), minlength=len(titles))
+
+        # New title ids of the previous index's titles; only worth reusing if none went away
+        carried = None
+        if previous is not None:
+            carried = pd.Index(self.titles).get_indexer(previous.titles)
+            if (carried < 0).any():
+                carried = None
+        if carried is None:
+            self._index_titles(np.arange(len(self.titles)))
+        else:
+            self._extend(previous, carried)
+
+    def _index_titles(self, title_ids):
+        postings = {}
+        for title_id in title_ids:
+            for word in set(words(self.titles[title_id])):
+                postings.setdefault(word, []).append(title_id)
+        self.terms = sorted(postings)
+        self.postings = [np.asarray(postings[term], dtype=np.int32) for term in self.terms]
+
+        # Typo lookups: hashes of every one-deletion variant of the longer terms, sorted, with
+        # the term each came from. Two words one edit apart always share a variant.
+        hashes, term_ids = self._variants_of(range(len(self.terms)))
+        variant_order = np.argsort(hashes, kind="stable")
+        self._variant_hashes = hashes[variant_order]
+        self._variant_terms = term_ids[variant_order]
+
+    def _variants_of(self, term_ids):
+        hashes, variant_terms = [], []
+        for term_id in term_ids:
+            term = self.terms[term_id]
+            if len(term) >= MIN_FUZZY_LENGTH:
+                for variant in _variants(term):
+                    hashes.append(hash(variant))
+                    variant_terms.append(term_id)
+        return np.asarray(hashes, dtype=np.int64), np.asarray(variant_terms, dtype=np.int32)
+
+    def _extend(self, previous, carried):
+        # Words of the titles previous didn't have, as (term, title id) pairs
+        is_new = np.ones(len(self.titles), dtype=bool)
+        is_new[carried] = False
+        new_words, new_ids = [], []
+        for title_id in np.flatnonzero(is_new):
+            for word in set(words(self.titles[title_id])):
+                new_words.append(word)
+                new_ids.append(title_id)
+
+        self.terms = sorted(set(previous.terms).union(new_words))
+        term_index = pd.Index(self.terms)
+        old_terms = term_index.get_indexer(previous.terms)
+
+        # Every posting as a (term id, title id) pair, regrouped by term in title order
+        lengths = [len(ids) for ids in previous.postings]
+        term_ids = np.concatenate([
+            np.repeat(old_terms, lengths), term_index.get_indexer(new_words),
+        ]).astype(np.int32)
+        title_ids = np.concatenate([
+            carried[np.concatenate(previous.postings or [np.zeros(0, dtype=np.int32)])], new_ids,
+        ]).astype(np.int32)
+        order = np.lexsort((title_ids, term_ids))
+        bounds = np.cumsum(np.bincount(term_ids, minlength=len(self.terms)))[:-1]
+        self.postings = np.split(title_ids[order], bounds)
+
+        # The previous variants under their new term ids, plus those of the new terms
+        added_terms = np.setdiff1d(np.arange(len(self.terms)), old_terms)
+        added_hashes, added_variant_terms = self._variants_of(added_terms)
+        hashes = np.concatenate([previous._variant_hashes, added_hashes])
+        variant_terms = np.concatenate([old_terms[previous._variant_terms], added_variant_terms]).astype(np.int32)
+        variant_order = np.lexsort((variant_terms, hashes))
+        self._variant_hashes = hashes[variant_order]
+        self._variant_terms = variant_terms[variant_order]
+
+    def __len__(self):
+        return len(self.titles)
+
+    def _term_id(self, term):
+        i = bisect_left(self.terms, term)
+        return i if i < len(self.terms) and self.terms[i] == term else None
+
+    def _matching_terms(self, word):
+        """Vocabulary terms matching one query word, with the quality of each match."""
+        matches = {}
+        if len(word) >= MIN_PREFIX_LENGTH:
+            start = bisect_left(self.terms, word)
+            stop = bisect_left(self.terms, word + "￿")
+            matches.update((term_id, PREFIX) for term_id in range(start, stop))
+        if len(word) >= MIN_FUZZY_LENGTH - 1:
+            for variant in _variants(word):
+                key = hash(variant)
+                lo = np.searchsorted(self._variant_hashes, key, side="left")
+                hi = np.searchsorted(self._variant_hashes, key, side="right")
+                for term_id in self._variant_terms[lo:hi]:
+                    if term_id not in matches and _one_edit(word, self.terms[term_id]):
+                        matches[int(term_id)] = FUZZY
+        term_id = self._term_id(word)
+        if term_id is not None:
+            matches[term_id] = EXACT
+        return matches
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """Every branch's checkouts of the titles best matching query.
+
+        A title matches when each query word matches one of its words exactly, as a prefix
+        or with one typo. Titles are ranked by match quality, then by total checkouts.
+        """
+        score = None
+        for word in words(query):
+            word_score = np.zeros(len(self.titles), dtype=np.int8)
+            for term_id, quality in self._matching_terms(word).items():
+                ids = self.postings[term_id]
+                word_score[ids] = np.maximum(word_score[ids], quality)
+            score = word_score.astype(np.int32) if score is None else np.where(word_score > 0, score + word_score, 0)
+        if score is None:
+            return self.rows.iloc[0:0], 0
+
+        matched = np.flatnonzero(score)
+        best = matched[np.lexsort((-self.checkouts[matched], -score[matched]))][:limit]
+        positions = np.concatenate([np.arange(self._starts[t], self._starts[t + 1]) for t in best] or [[]]).astype(int)
+        return self.rows.iloc[positions], len(matched)